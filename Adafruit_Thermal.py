@@ -37,6 +37,37 @@ from __future__ import print_function
 from serial import Serial
 import time
 
+# Printer pacing needs a clock that never jumps (NTP steps would stall
+# or rush output).  Python 3.3+ has one built in; on Python 2 the
+# Linux CLOCK_MONOTONIC is read through ctypes, falling back to the
+# wall clock if that isn't possible.
+try:
+	from time import monotonic
+except ImportError:
+	try:
+		import ctypes, ctypes.util
+
+		class timespec(ctypes.Structure):
+			_fields_ = [('tv_sec',  ctypes.c_long),
+			            ('tv_nsec', ctypes.c_long)]
+
+		CLOCK_MONOTONIC = 1
+		librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+		                    'librt.so.1', use_errno=True)
+		clock_gettime = librt.clock_gettime
+		clock_gettime.argtypes = [ctypes.c_int,
+		                          ctypes.POINTER(timespec)]
+
+		def monotonic():
+			t = timespec()
+			if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+				raise OSError(ctypes.get_errno())
+			return t.tv_sec + t.tv_nsec * 1e-9
+
+		monotonic()
+	except Exception:
+		monotonic = time.time
+
 class Adafruit_Thermal(Serial):
 
 	resumeTime      =  0.0
@@ -51,11 +82,28 @@ class Adafruit_Thermal(Serial):
 	barcodeHeight   = 50
 	printMode       =  0
 	defaultHeatTime = 60
+	spinTime        =  0.0005
+	waitCount       =  0
+	jitterTotal     =  0.0
+	jitterMax       =  0.0
+	minBlankRun     =  4
+	blankBytesSaved =  0
+	blankTimeSaved  =  0.0
+	marginBytesSaved = 0
+	leftMargin      =  0
+	dotsFed         =  0  # paper advanced so far, in dots (8/mm)
+
+	transport       = None
 
 	def __init__(self, *args, **kwargs):
 		# If no parameters given, use default port & baud rate.
 		# If only port is passed, use default baud rate.
 		# If both passed, use those values.
+		# A 'transport' keyword (any object with write(), read() and
+		# close(), such as simulator.SimulatedPrinter) replaces the
+		# serial port entirely; the baud rate is still used for timing.
+		heatTime = kwargs.pop('heattime', self.defaultHeatTime)
+		self.transport = kwargs.pop('transport', None)
 		baudrate = 19200
 		if len(args) == 0:
 			args = [ "/dev/ttyAMA0", baudrate ]
@@ -70,7 +118,8 @@ class Adafruit_Thermal(Serial):
 		# caution here.
 		self.byteTime = 11.0 / float(baudrate)
 
-		Serial.__init__(self, *args, **kwargs)
+		if self.transport is None:
+			Serial.__init__(self, *args, **kwargs)
 
 		# Remainder of this method was previously in begin()
 
@@ -97,7 +146,6 @@ class Adafruit_Thermal(Serial):
 		# blank page may occur.  The more heating interval, the more
 		# clear, but the slower printing speed.
 
-		heatTime = kwargs.get('heattime', self.defaultHeatTime)
 		self.writeBytes(
 		  27,       # Esc
 		  55,       # 7 (print settings)
@@ -140,11 +188,38 @@ class Adafruit_Thermal(Serial):
 
 	# Sets estimated completion time for a just-issued task.
 	def timeoutSet(self, x):
-		self.resumeTime = time.time() + x
+		self.resumeTime = monotonic() + x
 
-	# Waits (if necessary) for the prior task to complete.
+	# Waits (if necessary) for the prior task to complete.  Rather
+	# than spinning on the clock for the whole time (which pegs the
+	# CPU while e.g. a bitmap prints), this sleeps until just short
+	# of the deadline and only spins for the last spinTime seconds.
+	# How late each wake-up was is kept for pacingStats().
 	def timeoutWait(self):
-		while (time.time() - self.resumeTime) < 0: pass
+		remaining = self.resumeTime - monotonic()
+		if remaining <= 0:
+			return
+		if remaining > self.spinTime:
+			time.sleep(remaining - self.spinTime)
+		while monotonic() < self.resumeTime: pass
+
+		late = monotonic() - self.resumeTime
+		self.waitCount  += 1
+		self.jitterTotal += late
+		if late > self.jitterMax:
+			self.jitterMax = late
+
+	# Returns (number of waits, mean and max wake-up jitter in seconds)
+	def pacingStats(self):
+		if not self.waitCount:
+			return (0, 0.0, 0.0)
+		return (self.waitCount, self.jitterTotal / self.waitCount,
+		        self.jitterMax)
+
+	def resetPacingStats(self):
+		self.waitCount   = 0
+		self.jitterTotal = 0.0
+		self.jitterMax   = 0.0
 
 
 	# Printer performance may vary based on the power supply voltage,
@@ -165,22 +240,52 @@ class Adafruit_Thermal(Serial):
 		self.dotFeedTime  = f / 1000000.0
 
 
+	# All output to the printer goes through here, so subclasses can
+	# redirect it (e.g. to record a print job instead).
+	def writeRaw(self, data):
+		if self.transport is not None:
+			self.transport.write(data)
+		else:
+			super(Adafruit_Thermal, self).write(data)
+
+	def readRaw(self, size=1):
+		if self.transport is not None:
+			return self.transport.read(size)
+		return super(Adafruit_Thermal, self).read(size)
+
+	def close(self):
+		if self.transport is not None:
+			self.transport.close()
+		else:
+			super(Adafruit_Thermal, self).close()
+
+
 	# 'Raw' byte-writing method
 	def writeBytes(self, *args):
 		self.timeoutWait()
 		self.timeoutSet(len(args) * self.byteTime)
-		for arg in args:
-			super(Adafruit_Thermal, self).write(chr(arg))
+		self.writeRaw(bytearray(args))
 
 
 	# Override write() method to keep track of paper feed.
+	# The column/wrap/feed timing model is applied to each character
+	# in a single pass, but output is only split where the printer
+	# needs a pause (at the end of each printed or fed line).  Every
+	# line goes out in one serial write, followed by one timeout
+	# covering all of its characters.
 	def write(self, *data):
-		for i in range(len(data)):
-			c = data[i]
-			if c != 0x13:
-				self.timeoutWait()
-				super(Adafruit_Thermal, self).write(c)
-				d = self.byteTime
+		for text in data:
+			start = 0
+			d     = 0.0
+			for i in range(len(text)):
+				c = text[i]
+				if c == '\x13':
+					# Skip XOFF, flush what came before it
+					self.writeSegment(text[start:i], d)
+					start = i + 1
+					d     = 0.0
+					continue
+				d += self.byteTime
 				if ((c == '\n') or
 				    (self.column == self.maxColumn)):
 					# Newline or wrap
@@ -199,10 +304,24 @@ class Adafruit_Thermal(Serial):
 						# Treat wrap as newline
 						# on next pass
 						c = '\n'
+					self.dotsFed += (self.charHeight +
+					                 self.lineSpacing)
+					# Printer is busy with this line
+					self.writeSegment(text[start:i + 1], d)
+					start = i + 1
+					d     = 0.0
 				else:
 					self.column += 1
-				self.timeoutSet(d)
 				self.prevByte = c
+			self.writeSegment(text[start:], d)
+
+	# Send a run of text and set the timeout for all of it at once.
+	def writeSegment(self, segment, d):
+		if not segment:
+			return
+		self.timeoutWait()
+		self.writeRaw(segment)
+		self.timeoutSet(d)
 
 
 	# The bulk of this method was moved into __init__,
@@ -224,6 +343,7 @@ class Adafruit_Thermal(Serial):
 		self.charHeight    = 24
 		self.lineSpacing   =  8
 		self.barcodeHeight = 50
+		self.leftMargin    =  0
 		self.writeBytes(27, 64)
 
 
@@ -267,7 +387,8 @@ class Adafruit_Thermal(Serial):
 		# Print string
 		self.timeoutWait()
 		self.timeoutSet((self.barcodeHeight + 40) * self.dotPrintTime)
-		super(Adafruit_Thermal, self).write(text)
+		self.dotsFed += self.barcodeHeight + 40
+		self.writeRaw(text)
 		self.prevByte = '\n'
 		self.feed(2)
 
@@ -370,7 +491,8 @@ class Adafruit_Thermal(Serial):
 	# Feeds by the specified number of individual pixel rows
 	def feedRows(self, rows):
 		self.writeBytes(27, 74, rows)
-		self.timeoutSet(rows * dotFeedTime)
+		self.timeoutSet(rows * self.dotFeedTime)
+		self.dotsFed += rows
 
 
 	def flush(self):
@@ -408,7 +530,19 @@ class Adafruit_Thermal(Serial):
 		self.underlineOn(0)
 
 
-	def printBitmap(self, w, h, bitmap, LaaT=False):
+	# If feedBlank is True, runs of at least minBlankRun all-white
+	# rows are not sent as bitmap data but skipped over with dot
+	# feeds (ESC J), which cost 3 bytes and feed time rather than a
+	# full row of bytes and print time each.  If trimBlank is True,
+	# white rows at the top and bottom of the bitmap are dropped
+	# entirely.  What this saves is added to blankBytesSaved and
+	# blankTimeSaved.  If trimMargins is True, white byte columns at
+	# either side are not sent; the left margin (GS L) is moved over
+	# instead so the image stays where it was.  The bounding box is
+	# worked out per chunk, or across all rows in LaaT mode (changing
+	# the margin for every scanline would cost more than it saves).
+	def printBitmap(self, w, h, bitmap, LaaT=False,
+	                feedBlank=False, trimBlank=False, trimMargins=False):
 		rowBytes = (w + 7) / 8  # Round up to next byte boundary
 		if rowBytes >= 48:
 			rowBytesClipped = 48  # 384 pixels max width
@@ -424,61 +558,193 @@ class Adafruit_Thermal(Serial):
 		if LaaT: maxChunkHeight = 1
 		else:    maxChunkHeight = 255
 
-		i = 0
-		for rowStart in range(0, h, maxChunkHeight):
-			chunkHeight = h - rowStart
+		if not isinstance(bitmap, bytearray):
+			bitmap = bytearray(bitmap)
+
+		if feedBlank or trimBlank:
+			runs = self.blankRuns(h, bitmap, rowBytes,
+			                      rowBytesClipped, feedBlank, trimBlank)
+		else:
+			runs = []
+
+		row = 0
+		for blankStart, blankRows in runs + [(h, 0)]:
+			self.printRows(row, blankStart, maxChunkHeight, bitmap,
+			               rowBytes, rowBytesClipped, trimMargins)
+			row = blankStart + blankRows
+			if not blankRows:
+				continue
+
+			# Bytes and time the rows would have cost as bitmap data,
+			# counting the DC2 '*' header of each chunk they'd fill
+			chunks     = (blankRows + maxChunkHeight - 1) // maxChunkHeight
+			savedBytes = blankRows * rowBytesClipped + 4 * chunks
+			savedTime  = (blankRows * self.dotPrintTime +
+			              savedBytes * self.byteTime)
+			if (blankStart > 0 and row < h) or not trimBlank:
+				feedRows = blankRows
+				while feedRows > 0:
+					n = min(feedRows, 255)
+					self.feedRows(n)
+					savedBytes -= 3
+					savedTime  -= 3 * self.byteTime
+					feedRows   -= n
+				savedTime -= blankRows * self.dotFeedTime
+			self.blankBytesSaved += savedBytes
+			self.blankTimeSaved  += savedTime
+
+		if self.leftMargin:
+			self.setLeftMargin(0)
+		self.prevByte = '\n'
+
+	# Send bitmap rows [first, last) in chunks of up to maxChunkHeight.
+	# Chunks go out as slices of a memoryview over the bitmap, so no
+	# per-byte conversion or copying takes place.  Rows wider than 48
+	# bytes are clipped by gathering each byte column with a strided
+	# slice instead.
+	def printRows(self, first, last, maxChunkHeight, bitmap,
+	              rowBytes, rowBytesClipped, trimMargins=False):
+		if first >= last:
+			return
+		view  = memoryview(bitmap)
+		left  = 0
+		right = rowBytesClipped
+		if trimMargins and maxChunkHeight == 1:
+			left, right = self.inkColumns(bitmap, first * rowBytes,
+			  last * rowBytes, rowBytes, rowBytesClipped)
+
+		for rowStart in range(first, last, maxChunkHeight):
+			chunkHeight = last - rowStart
 			if chunkHeight > maxChunkHeight:
 				chunkHeight = maxChunkHeight
 
+			start = rowStart * rowBytes
+			end   = start + chunkHeight * rowBytes
+			if trimMargins and maxChunkHeight > 1:
+				left, right = self.inkColumns(bitmap, start, end,
+				  rowBytes, rowBytesClipped)
+			chunkBytes = right - left
+			if trimMargins:
+				self.marginBytesSaved += chunkHeight * (
+				  rowBytesClipped - chunkBytes)
+				if self.leftMargin != left * 8:
+					self.setLeftMargin(left * 8)
+
 			# Timeout wait happens here
-			self.writeBytes(18, 42, chunkHeight, rowBytesClipped)
-
-			for y in range(chunkHeight):
-				for x in range(rowBytesClipped):
-					super(Adafruit_Thermal, self).write(
-					  chr(bitmap[i]))
-					i += 1
-				i += rowBytes - rowBytesClipped
+			self.writeBytes(18, 42, chunkHeight, chunkBytes)
+
+			if chunkBytes == rowBytes:
+				chunk = view[start:end]
+			else:
+				chunk = bytearray(chunkHeight * chunkBytes)
+				for x in range(chunkBytes):
+					chunk[x::chunkBytes] = \
+					  bitmap[start + left + x:end:rowBytes]
+			self.writeRaw(chunk)
 			self.timeoutSet(chunkHeight * self.dotPrintTime)
-
-		self.prevByte = '\n'
+			self.dotsFed += chunkHeight
+
+	# Find the byte columns [left, right) holding any black pixels in
+	# the rows of bitmap between offsets start and end.  An all-white
+	# area still gets one byte column so that its rows are sent.
+	def inkColumns(self, bitmap, start, end, rowBytes, rowBytesClipped):
+		blank = bytearray((end - start) / rowBytes)
+		left  = 0
+		while (left < rowBytesClipped and
+		       bitmap[start + left:end:rowBytes] == blank):
+			left += 1
+		if left == rowBytesClipped:
+			return 0, 1
+		right = rowBytesClipped
+		while bitmap[start + right - 1:end:rowBytes] == blank:
+			right -= 1
+		return left, right
+
+	# Find runs of all-white rows in a bitmap.  Returns a list of
+	# (first row, number of rows) for every run worth feeding over
+	# (if feed is True) and for the leading and trailing runs (if
+	# trim is True).
+	def blankRuns(self, h, bitmap, rowBytes, rowBytesClipped,
+	              feed=True, trim=False):
+		blank = bytearray(rowBytesClipped)
+		runs  = []
+		runStart = None
+		for y in range(h + 1):
+			if y < h:
+				n = y * rowBytes
+				if bitmap[n:n + rowBytesClipped] == blank:
+					if runStart is None:
+						runStart = y
+					continue
+			if runStart is not None:
+				edge = (runStart == 0 or y == h)
+				if (feed and y - runStart >= self.minBlankRun) or \
+				   (trim and edge):
+					runs.append((runStart, y - runStart))
+				runStart = None
+		return runs
 
 	# Print Image.  Requires Python Imaging Library.  This is
 	# specific to the Python port and not present in the Arduino
 	# library.  Image will be cropped to 384 pixels width if
-	# necessary, and converted to 1-bit w/diffusion dithering.
-	# For any other behavior (scale, B&W threshold, etc.), use
-	# the Imaging Library to perform such operations before
-	# passing the result to this function.
-	def printImage(self, image, LaaT=False):
-		import Image
-
-		if image.mode != '1':
+	# necessary, or scaled down to it if fit is True, and
+	# converted to 1-bit w/diffusion dithering unless another
+	# dither is named ('threshold', 'ordered'; see dither.py).
+	# For any other behavior, use the Imaging Library to perform
+	# such operations before passing the result to this function.
+	def printImage(self, image, LaaT=False,
+	               feedBlank=False, trimBlank=False, trimMargins=False,
+	               dither=None, fit=False):
+		width, height, bitmap = self.packImage(image, dither, fit)
+		self.printBitmap(width, height, bitmap, LaaT,
+		                 feedBlank, trimBlank, trimMargins)
+
+
+	# Lookup tables for packImage().  PIL's raw 1-bit layout uses a
+	# set bit for white, the printer wants a set bit for black, so
+	# every byte is inverted.  The pad bits at the end of each row
+	# (when width isn't a multiple of 8) are then cleared again so
+	# they don't print as a black stripe.
+	invertTable = ''.join([chr(255 - i) for i in range(256)])
+	padTables   = [None] + [''.join([chr(i & ((0xFF << (8 - n)) & 0xFF))
+	                                 for i in range(256)])
+	                        for n in range(1, 8)]
+
+	# Convert an image to the row-byte layout used by printBitmap().
+	# Image is cropped to 384 pixels width if necessary (or scaled)
+	# and converted to 1-bit, as for printImage.  Rather than walking
+	# the image pixel by pixel, the raw 1-bit data is pulled out of
+	# PIL in one go and fixed up with byte translations and slices,
+	# so all of the work happens in C.  Returns (width, height, bitmap).
+	@staticmethod
+	def packImage(image, dither=None, fit=False):
+		if dither or fit:
+			import dither as engines
+			image = engines.convert(image, dither, fit)
+		elif image.mode != '1':
 			image = image.convert('1')
 
 		width  = image.size[0]
 		height = image.size[1]
 		if width > 384:
 			width = 384
+			image = image.crop((0, 0, width, height))
 		rowBytes = (width + 7) / 8
-		bitmap   = bytearray(rowBytes * height)
-		pixels   = image.load()
-
-		for y in range(height):
-			n = y * rowBytes
-			x = 0
-			for b in range(rowBytes):
-				sum = 0
-				bit = 128
-				while bit > 0:
-					if x >= width: break
-					if pixels[x, y] == 0:
-						sum |= bit
-					x    += 1
-					bit >>= 1
-				bitmap[n + b] = sum
-
-		self.printBitmap(width, height, bitmap, LaaT)
+
+		# Older PIL only has tostring(), newer Pillow only tobytes()
+		if hasattr(image, 'tobytes'):
+			raw = image.tobytes('raw', '1')
+		else:
+			raw = image.tostring('raw', '1')
+		bitmap = bytearray(raw.translate(Adafruit_Thermal.invertTable))
+
+		padBits = width % 8
+		if padBits:
+			last = rowBytes - 1
+			bitmap[last::rowBytes] = str(bitmap[last::rowBytes]).translate(
+			  Adafruit_Thermal.padTables[padBits])
+
+		return width, height, bitmap
 
 
 	# Take the printer offline. Print commands sent after this
@@ -520,7 +786,7 @@ class Adafruit_Thermal(Serial):
 	def hasPaper(self):
 		self.writeBytes(27, 118, 0)
 		# Bit 2 of response seems to be paper status
-		stat = ord(self.read(1)) & 0b00000100
+		stat = ord(self.readRaw(1)) & 0b00000100
 		# If set, we have paper; if clear, no paper
 		return stat == 0
 
@@ -537,6 +803,13 @@ class Adafruit_Thermal(Serial):
 		self.writeBytes(27, 51, val)
 
 
+	# Sets the left margin in dots (GS L nL nH).  Used by printBitmap()
+	# to keep trimmed bitmaps in place.
+	def setLeftMargin(self, dots=0):
+		self.leftMargin = dots
+		self.writeBytes(29, 76, dots & 0xFF, dots >> 8)
+
+
 	# Copied from Arduino lib for parity; is marked 'not working' there
 	def tab(self):
 		self.writeBytes(9)
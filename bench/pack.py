@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Benchmark for Adafruit_Thermal.packImage(), compared against the
+# original pixel-at-a-time loop from printImage().  Also checks that
+# both produce byte-identical bitmaps for a range of image sizes.
+#
+# Written by Ted M Lin.  MIT license.
+#
+# Usage: python bench/pack.py [repeat]
+
+from __future__ import print_function
+import os, sys, time, random
+import Image
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+from Adafruit_Thermal import Adafruit_Thermal
+
+def pack_loop(image):
+    """ The original per-pixel packing loop from printImage() """
+    if image.mode != '1':
+        image = image.convert('1')
+
+    width  = image.size[0]
+    height = image.size[1]
+    if width > 384:
+        width = 384
+    rowBytes = (width + 7) / 8
+    bitmap   = bytearray(rowBytes * height)
+    pixels   = image.load()
+
+    for y in range(height):
+        n = y * rowBytes
+        x = 0
+        for b in range(rowBytes):
+            sum = 0
+            bit = 128
+            while bit > 0:
+                if x >= width: break
+                if pixels[x, y] == 0:
+                    sum |= bit
+                x    += 1
+                bit >>= 1
+            bitmap[n + b] = sum
+
+    return width, height, bitmap
+
+def noise_image(width, height):
+    img = Image.new('L', (width, height))
+    img.putdata([random.randint(0, 255) for i in range(width * height)])
+    return img
+
+def check():
+    """ Compare both packers on awkward sizes """
+    random.seed(1)
+    sizes = [ (1, 1), (7, 3), (8, 5), (9, 5), (330, 117), (383, 2),
+              (384, 4), (385, 4), (390, 7), (512, 3) ]
+    for size in sizes:
+        img = noise_image(*size)
+        if pack_loop(img) != Adafruit_Thermal.packImage(img):
+            print("MISMATCH at %dx%d" % size)
+            return False
+    return True
+
+def timeit(func, img, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(img)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    repeat = 3
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+
+    if not check():
+        sys.exit(1)
+    print("packImage output matches original loop")
+
+    gfx_dir = os.path.join(root_dir, 'gfx')
+    for name in sorted(os.listdir(gfx_dir)):
+        if not name.endswith('.png'):
+            continue
+        img = Image.open(os.path.join(gfx_dir, name)).convert('1')
+        old = timeit(pack_loop, img, repeat)
+        new = timeit(Adafruit_Thermal.packImage, img, repeat)
+        print("%-14s %4dx%-4d  loop %8.2f ms  packImage %6.2f ms  (%.0fx)" %
+              (name, img.size[0], img.size[1], old * 1000, new * 1000,
+               old / max(new, 1e-9)))
+
+if __name__ == '__main__':
+    main()
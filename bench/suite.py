@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# Benchmark suite for the IoT printer: driver hot paths, image
+# rendering and every bundled feed, end to end.
+#
+# Everything runs against a simulated printer (see simulator.py) whose
+# pacing is switched off, so the numbers are pure CPU/IO cost, plus
+# recorded HTTP responses and subprocess output from bench/fixtures.
+# Each scenario runs in its own forked process so that peak memory is
+# per scenario.  For each one the suite reports:
+#
+#   cpu         user+system seconds (best of --repeat runs)
+#   wall        elapsed seconds (best of --repeat runs)
+#   bytes       bytes sent to the printer
+#   print_time  modeled seconds for the printer to produce the output
+#   paper_mm    paper used
+#   peak_rss_kb peak resident memory of the scenario's process
+#
+# Results can be saved as JSON (-o) and compared against an earlier
+# run (-c) to see what a change did.
+#
+# Written by Ted M Lin.  MIT license.
+#
+# Usage: python bench/suite.py [-r repeat] [-o results.json]
+#                              [-c baseline.json] [scenario ...]
+
+from __future__ import print_function
+import os, sys, time, json, argparse, subprocess, resource
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(bench_dir)
+fixture_dir = os.path.join(bench_dir, 'fixtures')
+gfx_dir = os.path.join(root_dir, 'gfx')
+feed_dir = os.path.join(root_dir, 'feeds')
+sys.path.insert(0, root_dir)
+
+# Recorded responses, by a substring of the URL or the program name
+URL_FIXTURES = [ ('forecastrss', 'forecastrss.xml'),
+                 ('search.json', 'search.json'),
+                 ('calendar/feeds', 'calendar.xml') ]
+COMMAND_FIXTURES = { 'fortune': 'fortune.txt',
+                     'sudoku': 'sudoku.txt' }
+
+def fixture(name):
+    with open(os.path.join(fixture_dir, name), 'rb') as f:
+        return f.read()
+
+def fake_request(url, headers):
+    for key, name in URL_FIXTURES:
+        if key in url:
+            return 200, {}, fixture(name)
+    raise IOError("no fixture for " + url)
+
+def fake_check_output(args, *more, **kwargs):
+    name = os.path.basename(args[0])
+    if name in COMMAND_FIXTURES:
+        return fixture(COMMAND_FIXTURES[name])
+    raise OSError("no fixture for " + name)
+
+def install_fixtures():
+    """ Route the feeds' network and subprocess calls to fixtures """
+    import deadline, fetch
+    fetch.client.request = fake_request
+    deadline.check_output = fake_check_output
+
+
+def make_printer():
+    """ Driver wired to a simulated printer, with pacing turned off """
+    from Adafruit_Thermal import Adafruit_Thermal
+    from simulator import SimulatedPrinter
+    sink = lambda: SimulatedPrinter(realtime=False, keep_paper=False)
+    printer = Adafruit_Thermal(transport=sink())
+    printer.timeoutWait = lambda: None
+    printer.transport = sink()  # don't count the init sequence
+    return printer
+
+def load_feed(name):
+    """ Import a feed the way the daemon does; returns its Feed """
+    from feedregistry import FeedRegistry
+    feed = FeedRegistry(feed_dir).get(name)
+    if not feed.load():
+        raise ImportError(feed.error)
+    return feed
+
+def load_image(name):
+    import Image
+    img = Image.open(os.path.join(gfx_dir, name))
+    img.load()
+    return img
+
+
+# --- scenarios ---
+# Each returns a function to time; setup happens outside the timing.
+
+def pack_scenario(asset, dither=None):
+    def setup():
+        from Adafruit_Thermal import Adafruit_Thermal
+        img = load_image(asset)
+        return lambda printer: Adafruit_Thermal.packImage(img, dither)
+    return setup
+
+def image_scenario(asset):
+    def setup():
+        img = load_image(asset)
+        return lambda printer: printer.printImage(img, True, feedBlank=True)
+    return setup
+
+def write_setup():
+    lines = [ ('line %d of text, long enough to wrap around ' % i) * 2
+              for i in range(200) ]
+    def run(printer):
+        for line in lines:
+            printer.println(line)
+    return run
+
+def bitmap_setup():
+    from Adafruit_Thermal import Adafruit_Thermal
+    width, height, bitmap = Adafruit_Thermal.packImage(load_image('sudoku.png'))
+    return lambda printer: printer.printBitmap(width, height, bitmap, True)
+
+def import_scenario(name):
+    def setup():
+        install_fixtures()
+        import feedregistry   # time the feed, not the registry
+        return lambda printer: load_feed(name)
+    return setup
+
+def feed_scenario(name, args):
+    def setup():
+        install_fixtures()
+        os.chdir(root_dir)
+        feed = load_feed(name)
+        return lambda printer: feed(printer, dict(args), {})
+    return setup
+
+FEEDS = [ ('drawimage', { 'file': 'gfx/hello.png' }),
+          ('forecast', { 'location': '2373572' }),
+          ('fortune', {}),
+          ('showip', {}),
+          ('sudoku-gfx', {}),
+          ('timetemp', { 'location': '2373572' }),
+          ('twitter', { 'query': 'from:Adafruit' }),
+          ('cal', { 'ME': 'user%40gmail.com/private-1234567' }) ]
+
+def scenarios():
+    result = [ ('driver:write', write_setup),
+               ('driver:bitmap', bitmap_setup) ]
+    for asset in sorted(os.listdir(gfx_dir)):
+        if asset.endswith('.png'):
+            result.append(('pack:' + asset, pack_scenario(asset)))
+            result.append(('image:' + asset, image_scenario(asset)))
+    for dither in ('threshold', 'ordered', 'floyd-steinberg'):
+        result.append(('dither:' + dither, pack_scenario('timetemp.png',
+                                                         dither)))
+    for name, args in FEEDS:
+        result.append(('import:' + name, import_scenario(name)))
+        result.append(('feed:' + name, feed_scenario(name, args)))
+    return result
+
+
+# --- runner ---
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def measure(setup, repeat):
+    """ Run a scenario (in this process) and return its numbers """
+    run = setup()
+    best_cpu = best_wall = None
+    for i in range(repeat):
+        printer = make_printer()
+        c0 = cpu_time()
+        w0 = time.time()
+        run(printer)
+        w1 = time.time()
+        cpu = cpu_time() - c0
+        wall = w1 - w0
+        if best_cpu is None or cpu < best_cpu:
+            best_cpu = cpu
+        if best_wall is None or wall < best_wall:
+            best_wall = wall
+
+    sim = printer.transport
+    sim.close()
+    return { 'cpu': best_cpu, 'wall': best_wall, 'bytes': sim.bytes,
+             'print_time': sim.print_time, 'paper_mm': sim.paper_length() }
+
+def run_isolated(setup, repeat):
+    """ Run a scenario in a forked child to get its own peak memory """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        try:
+            result = measure(setup, repeat)
+        except Exception as e:
+            result = { 'error': '%s: %s' % (e.__class__.__name__, e) }
+        os.write(wfd, json.dumps(result))
+        os._exit(0)
+
+    os.close(wfd)
+    data = []
+    while True:
+        chunk = os.read(rfd, 65536)
+        if not chunk:
+            break
+        data.append(chunk)
+    os.close(rfd)
+    pid, status, usage = os.wait4(pid, 0)
+    try:
+        result = json.loads(''.join(data))
+    except ValueError:
+        result = { 'error': 'scenario crashed (status %d)' % status }
+    result['peak_rss_kb'] = usage.ru_maxrss
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=root_dir).strip()
+    except Exception:
+        return None
+
+def report(results, baseline=None):
+    print("%-24s %9s %9s %8s %9s %8s %9s" % ('scenario', 'cpu ms', 'wall ms',
+          'bytes', 'print s', 'paper mm', 'peak KB'))
+    for name in sorted(results):
+        r = results[name]
+        if 'error' in r:
+            print("%-24s %s" % (name, r['error']))
+            continue
+        line = "%-24s %9.2f %9.2f %8d %9.2f %8.1f %9d" % (name,
+               r['cpu'] * 1000, r['wall'] * 1000, r['bytes'],
+               r['print_time'], r['paper_mm'], r['peak_rss_kb'])
+        old = (baseline or {}).get(name)
+        if old and 'error' not in old and old['wall'] > 0:
+            line += "   wall x%.2f  bytes %+d" % (r['wall'] / old['wall'],
+                                                 r['bytes'] - old['bytes'])
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="IoT printer benchmarks")
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', help="save results as JSON")
+    parser.add_argument('-c', '--compare', help="JSON results to compare to")
+    parser.add_argument('only', nargs='*', help="scenario name prefixes")
+    options = parser.parse_args()
+
+    results = {}
+    for name, setup in scenarios():
+        if options.only and not any(name.startswith(p) for p in options.only):
+            continue
+        results[name] = run_isolated(setup, options.repeat)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({ 'commit': git_commit(), 'time': time.time(),
+                        'python': sys.version.split()[0],
+                        'results': results }, f, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
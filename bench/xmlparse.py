@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Benchmark for xmlstream against the minidom code the weather and
+# calendar feeds used before.  Also checks that both pull out the same
+# data from the recorded responses in bench/fixtures.
+#
+# Written by Ted M Lin.  MIT license.
+#
+# Usage: python bench/xmlparse.py [repeat]
+
+from __future__ import print_function
+import os, sys, time
+from xml.dom.minidom import parseString
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(bench_dir)
+sys.path.append(root_dir)
+
+import xmlstream
+
+def fixture(name):
+    with open(os.path.join(bench_dir, 'fixtures', name), 'rb') as f:
+        return f.read()
+
+# --- the original minidom versions ---
+
+def gettag(dom, tag, idx):
+    return dom.getElementsByTagName(tag)[idx]
+
+def forecast_dom(xml):
+    dom = parseString(xml)
+    data = {}
+    data['heading'] = gettag(dom,'description',0).firstChild.data
+    data['cur-data'] = gettag(dom,'pubDate', 0).firstChild.data
+    data['cur-temp'] = gettag(dom,'yweather:condition',0).getAttribute('temp')
+    data['cur-cond'] = gettag(dom,'yweather:condition',0).getAttribute('text')
+    for n, day in enumerate(('today', 'tomm')):
+        data[day + '-day']  = gettag(dom,'yweather:forecast',n).getAttribute('day')
+        data[day + '-lo']   = gettag(dom,'yweather:forecast',n).getAttribute('low')
+        data[day + '-hi']   = gettag(dom,'yweather:forecast',n).getAttribute('high')
+        data[day + '-cond'] = gettag(dom,'yweather:forecast',n).getAttribute('text')
+    return data
+
+def weather_dom(xml):
+    dom = parseString(xml)
+    return (dom.getElementsByTagName('yweather:condition')[0].getAttribute('temp'),
+            dom.getElementsByTagName('yweather:atmosphere')[0].getAttribute('humidity'),
+            dom.getElementsByTagName('yweather:wind')[0].getAttribute('speed'),
+            dom.getElementsByTagName('yweather:wind')[0].getAttribute('direction'),
+            dom.getElementsByTagName('yweather:units')[0].getAttribute('speed'))
+
+def calendar_dom(xml):
+    dom = parseString(xml)
+    return [ (item.getElementsByTagName('title')[0].firstChild.data,
+              item.getElementsByTagName('gd:when')[0].getAttribute('startTime'))
+             for item in dom.getElementsByTagName('entry') ]
+
+# --- the same through xmlstream, as the feeds now do it ---
+
+def forecast_stream(xml):
+    tags = xmlstream.first(xml, { 'description': 1, 'pubDate': 1,
+                                  'yweather:condition': 1,
+                                  'yweather:forecast': 2 })
+    cur = tags['yweather:condition'][0]
+    data = {}
+    data['heading'] = tags['description'][0].text
+    data['cur-data'] = tags['pubDate'][0].text
+    data['cur-temp'] = cur.get('temp')
+    data['cur-cond'] = cur.get('text')
+    for n, day in enumerate(('today', 'tomm')):
+        f = tags['yweather:forecast'][n]
+        data[day + '-day']  = f.get('day')
+        data[day + '-lo']   = f.get('low')
+        data[day + '-hi']   = f.get('high')
+        data[day + '-cond'] = f.get('text')
+    return data
+
+def weather_stream(xml):
+    tags = xmlstream.first(xml, { 'yweather:condition': 1,
+                                  'yweather:atmosphere': 1,
+                                  'yweather:wind': 1, 'yweather:units': 1 })
+    return (tags['yweather:condition'][0].get('temp'),
+            tags['yweather:atmosphere'][0].get('humidity'),
+            tags['yweather:wind'][0].get('speed'),
+            tags['yweather:wind'][0].get('direction'),
+            tags['yweather:units'][0].get('speed'))
+
+def calendar_stream(xml):
+    return [ (item['title'].text, item['gd:when'].get('startTime'))
+             for item in xmlstream.records(xml, 'entry', ['title', 'gd:when']) ]
+
+CASES = [ ('forecast', 'forecastrss.xml', forecast_dom, forecast_stream),
+          ('timetemp', 'forecastrss.xml', weather_dom, weather_stream),
+          ('calendar', 'calendar.xml', calendar_dom, calendar_stream) ]
+
+def timeit(func, xml, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(xml)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    repeat = 20
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+
+    ok = True
+    for name, fixture_name, old, new in CASES:
+        xml = fixture(fixture_name)
+        if old(xml) != new(xml):
+            print("MISMATCH for %s" % name)
+            ok = False
+            continue
+        t_old = timeit(old, xml, repeat)
+        t_new = timeit(new, xml, repeat)
+        print("%-10s %7d bytes  minidom %7.2f ms  xmlstream %6.2f ms  (%.1fx)" %
+              (name, len(xml), t_old * 1000, t_new * 1000,
+               t_old / max(t_new, 1e-9)))
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
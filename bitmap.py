@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# Packed 1-bit bitmaps for the IoT printer: glyph atlases and a canvas
+# to composite them on, in the printer's own bitmap layout.
+#
+# Each row of a Glyph or Canvas is one Python integer, leftmost pixel
+# in the highest bit, a set bit for black.  Pasting a glyph is then a
+# shift, mask and or per row, and the finished canvas comes out as the
+# row bytes printBitmap() takes without ever going through PIL.
+#
+# An atlas (the glyphs cut from a sheet image) can be cached on disk,
+# so after the first run loading one doesn't need PIL at all.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import os, json, binascii
+
+root_dir = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(root_dir, 'cache')
+
+class Glyph(object):
+    """ A small packed bitmap """
+
+    def __init__(self, width, rows):
+        self.width = width
+        self.height = len(rows)
+        self.rows = rows
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    @classmethod
+    def from_image(cls, image):
+        """ Pack a PIL image (converted to 1-bit like paste() would) """
+        from Adafruit_Thermal import Adafruit_Thermal
+        width, height, bitmap = Adafruit_Thermal.packImage(image)
+        rowBytes = (width + 7) // 8
+        pad = rowBytes * 8 - width
+        rows = []
+        for y in range(height):
+            row = bitmap[y * rowBytes:(y + 1) * rowBytes]
+            rows.append(int(binascii.hexlify(row) or '0', 16) >> pad)
+        return cls(width, rows)
+
+class Canvas(object):
+    """ A bitmap to paste glyphs and draw boxes on
+
+    It starts out white, or as a copy of the background glyph if given
+    (which is cut down or padded to the canvas size).
+    """
+
+    def __init__(self, width, height, background=None):
+        self.width = width
+        self.height = height
+        self.rows = [0] * height
+        if background:
+            self.paste(background, 0, 0)
+
+    def paste(self, glyph, x, y):
+        """ Copy a glyph in (white pixels too), clipped to the canvas """
+        shift = self.width - x - glyph.width
+        full = (1 << self.width) - 1
+        if shift >= 0:
+            mask = (((1 << glyph.width) - 1) << shift) & full
+        else:
+            mask = ((1 << glyph.width) - 1) >> -shift
+        keep = ~mask
+        rows = self.rows
+        for i, bits in enumerate(glyph.rows):
+            r = y + i
+            if r < 0 or r >= self.height:
+                continue
+            if shift >= 0:
+                bits <<= shift
+            else:
+                bits >>= -shift
+            rows[r] = (rows[r] & keep) | (bits & mask)
+
+    def rectangle(self, x0, y0, x1, y1):
+        """ Fill a black box, corners included (like ImageDraw's) """
+        x0 = max(x0, 0)
+        x1 = min(x1, self.width - 1)
+        if x0 > x1:
+            return
+        bits = ((1 << (x1 - x0 + 1)) - 1) << (self.width - 1 - x1)
+        for r in range(max(y0, 0), min(y1, self.height - 1) + 1):
+            self.rows[r] |= bits
+
+    def pack(self):
+        """ (width, height, bitmap) in the layout printBitmap() takes """
+        rowBytes = (self.width + 7) // 8
+        pad = rowBytes * 8 - self.width
+        digits = rowBytes * 2
+        text = ''.join(['%0*x' % (digits, row << pad) for row in self.rows])
+        return self.width, self.height, bytearray(binascii.unhexlify(text))
+
+def load_atlas(name, sheet, boxes):
+    """ Glyphs cut from the sheet image at the given (x0, y0, x1, y1)
+
+    boxes maps glyph name to its box.  The packed glyphs are cached as
+    cache/<name>.atlas, and rebuilt whenever the sheet or boxes change.
+    """
+    st = os.stat(sheet)
+    key = [os.path.basename(sheet), st.st_mtime, st.st_size,
+           sorted([k, list(b)] for k, b in boxes.items())]
+    cache = os.path.join(CACHE_DIR, name + '.atlas')
+    try:
+        with open(cache) as f:
+            data = json.load(f)
+        if data['key'] == json.loads(json.dumps(key)):
+            return dict((k, Glyph(w, [int(r, 16) for r in rows]))
+                        for k, (w, rows) in data['glyphs'].items())
+    except (IOError, ValueError, KeyError):
+        pass
+
+    import Image
+    image = Image.open(sheet)
+    glyphs = dict((k, Glyph.from_image(image.crop(b).convert('1')))
+                  for k, b in boxes.items())
+
+    data = { 'key': key,
+             'glyphs': dict((k, [g.width, ['%x' % r for r in g.rows]])
+                            for k, g in glyphs.items()) }
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        with open(cache + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.rename(cache + '.tmp', cache)
+    except (IOError, OSError):
+        pass   # fine, just slower next time
+    return glyphs
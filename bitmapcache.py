@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# On-disk cache of images converted for the IoT printer.
+#
+# Turning an image file into printer bitmap data means decoding it,
+# dithering it down to 1-bit and packing the rows, which is the same
+# work every time the same picture is printed.  Here the result is kept
+# in cache/bitmaps, one small file per converted image, named by a hash
+# of the image file's content and the conversion options.  So a picture
+# printed again (under any name) is read straight back, memory-mapped,
+# with no PIL involved.
+#
+# The cache is kept under a size limit, dropping the least recently
+# used files first.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import os, io, mmap, struct, hashlib, tempfile, threading
+from Adafruit_Thermal import Adafruit_Thermal
+from bitmap import CACHE_DIR
+
+class BitmapCache(object):
+    """ Packed bitmaps (as printBitmap() takes them) by image content """
+
+    MAGIC   = b'PBIT'
+    VERSION = 1
+    HEADER  = struct.Struct('<4sBHII')   # magic, version, w, h, length
+    SUFFIX  = '.bits'
+
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, 'bitmaps'),
+                 max_bytes=4 << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(('hits', 'misses', 'evicted'), 0)
+
+    @staticmethod
+    def key(data, options):
+        """ Cache key for image file data converted with options (a dict) """
+        digest = hashlib.sha1(data)
+        digest.update(repr(sorted(options.items())))
+        return digest.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def lookup(self, key):
+        """ (width, height, bitmap) stored under key, or None """
+        name = self.filename(key)
+        try:
+            with open(name, 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None   # not there (or empty)
+        try:
+            magic, version, width, height, length = \
+                self.HEADER.unpack_from(m, 0)
+            if magic != self.MAGIC or version != self.VERSION or \
+               len(m) != self.HEADER.size + length:
+                return None
+            bitmap = bytearray(buffer(m, self.HEADER.size, length))
+        except struct.error:
+            return None
+        finally:
+            m.close()
+
+        try:
+            os.utime(name, None)   # recently used
+        except OSError:
+            pass
+        return width, height, bitmap
+
+    def store(self, key, width, height, bitmap):
+        """ Keep a packed bitmap, then trim the cache back to size """
+        data = self.HEADER.pack(self.MAGIC, self.VERSION, width, height,
+                                len(bitmap)) + bytes(bitmap)
+        if len(data) > self.max_bytes:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmpname = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmpname, self.filename(key))
+        except (IOError, OSError) as e:
+            print("bitmap cache: can't store %s: %s" % (key, e))
+            return
+        self.evict()
+
+    def evict(self):
+        """ Drop least recently used files until under max_bytes """
+        with self.lock:
+            entries = []
+            total = 0
+            try:
+                names = os.listdir(self.cache_dir)
+            except OSError:
+                return
+            for name in names:
+                if not name.endswith(self.SUFFIX):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.stats['evicted'] += 1
+
+    def pack_file(self, path, **options):
+        """ An image file as (width, height, bitmap), converted once """
+        with open(path, 'rb') as f:
+            data = f.read()
+        key = self.key(data, options)
+        packed = self.lookup(key)
+        if packed:
+            self.stats['hits'] += 1
+            return packed
+
+        self.stats['misses'] += 1
+        packed = self.convert(data, **options)
+        self.store(key, *packed)
+        return packed
+
+    @staticmethod
+    def convert(data, **options):
+        """ Decode and pack image file data (the slow part) """
+        import Image
+        return Adafruit_Thermal.packImage(Image.open(io.BytesIO(data)),
+                                          **options)
+
+# The one cache everything shares
+cache = BitmapCache()
+
+def pack_file(path, **options):
+    return cache.pack_file(path, **options)
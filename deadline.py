@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Time budgets for feeds.
+#
+# The daemon gives each feed run a deadline (see PrintManager.prepare),
+# kept per thread.  Feeds fetch through fetch.py and run programs with
+# check_output() here rather than subprocess, which hold them to it:
+# sockets time out when the budget runs out and programs still running
+# are killed.  Either way DeadlineExceeded is raised, and the deadline
+# remembers it was hit, so a feed that swallows the exception is still
+# counted as timing out.
+#
+# With no deadline set (e.g. a feed run on its own) nothing times out.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import threading, subprocess
+from Adafruit_Thermal import monotonic
+
+class DeadlineExceeded(Exception):
+    pass
+
+local = threading.local()
+
+class Deadline(object):
+    """ A point in (monotonic) time that the current work must finish by """
+
+    def __init__(self, when):
+        self.when = when
+        self.hit = False
+
+    def remaining(self):
+        return self.when - monotonic()
+
+    def __enter__(self):
+        self.outer = getattr(local, 'deadline', None)
+        local.deadline = self
+        return self
+
+    def __exit__(self, *exc):
+        local.deadline = self.outer
+
+def until(when):
+    """ Context manager running the enclosed code against a deadline """
+    return Deadline(when)
+
+def current():
+    return getattr(local, 'deadline', None)
+
+def remaining():
+    """ Seconds left (raising if there are none), or None if no deadline """
+    deadline = current()
+    if deadline is None:
+        return None
+    left = deadline.remaining()
+    if left <= 0:
+        expire()
+    return left
+
+def expire():
+    deadline = current()
+    if deadline:
+        deadline.hit = True
+    raise DeadlineExceeded()
+
+def check_output(args, **kwargs):
+    """ subprocess.check_output(), killing the program at the deadline """
+    left = remaining()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, **kwargs)
+    killer = None
+    if left is not None:
+        killer = threading.Timer(left, proc.kill)
+        killer.daemon = True
+        killer.start()
+    try:
+        output = proc.communicate()[0]
+    finally:
+        if killer:
+            killer.cancel()
+
+    if left is not None and current().remaining() <= 0:
+        expire()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args)
+    return output
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Getting images down to the printer's 1-bit, 384 dot wide paper.
+#
+# There is a choice of how grey turns into dots:
+#
+#   threshold        each pixel is black or white on its own; crisp and
+#                    the fastest, best for line art and text
+#   ordered          a fixed 8x8 Bayer pattern; regular, quick, and it
+#                    prints without the smearing error diffusion can
+#                    show on a thermal head
+#   floyd-steinberg  error diffusion (what PIL's convert('1') does); the
+#                    finest detail, and the slowest
+#
+# All of them run as whole-image operations inside PIL.  fit_width()
+# scales wide images down to the paper, asking the JPEG decoder for a
+# reduced size to start with (draft mode), so a big photo is never
+# decoded in full.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import Image, ImageChops
+
+WIDTH = 384   # dots across the paper
+
+# 8x8 Bayer index matrix; pixel (x, y) is black below threshold BAYER[y][x]
+BAYER = [ [  0, 32,  8, 40,  2, 34, 10, 42 ],
+          [ 48, 16, 56, 24, 50, 18, 58, 26 ],
+          [ 12, 44,  4, 36, 14, 46,  6, 38 ],
+          [ 60, 28, 52, 20, 62, 30, 54, 22 ],
+          [  3, 35, 11, 43,  1, 33,  9, 41 ],
+          [ 51, 19, 59, 27, 49, 17, 57, 25 ],
+          [ 15, 47,  7, 39, 13, 45,  5, 37 ],
+          [ 63, 31, 55, 23, 61, 29, 53, 21 ] ]
+
+def greyscale(image):
+    if image.mode != 'L':
+        image = image.convert('L')
+    return image
+
+def threshold(image, level=128):
+    """ Black below level, white from it up """
+    table = [0] * level + [255] * (256 - level)
+    return greyscale(image).point(table, '1')
+
+def ordered(image):
+    """ Ordered dither against the Bayer matrix """
+    grey = greyscale(image)
+    # lighter(pixel, threshold) is the pixel itself just where it is
+    # at least its threshold, i.e. should be white; these integer ops
+    # are much quicker in PIL than a subtract with an offset
+    over = ImageChops.lighter(grey, bayer_tile(grey.size))
+    return ImageChops.difference(over, grey).point([255] + [0] * 255, '1')
+
+def floyd_steinberg(image):
+    """ Floyd-Steinberg error diffusion """
+    return image.convert('1')
+
+ENGINES = { 'threshold': threshold,
+            'ordered': ordered,
+            'bayer': ordered,
+            'floyd-steinberg': floyd_steinberg,
+            'diffusion': floyd_steinberg }
+DEFAULT = 'floyd-steinberg'
+
+tiles = {}   # size -> Bayer thresholds tiled to that size
+
+def bayer_tile(size):
+    """ An 'L' image of the Bayer thresholds repeated over size """
+    tile = tiles.get(size)
+    if tile:
+        return tile
+
+    cell = Image.new('L', (8, 8))
+    cell.putdata([(BAYER[y][x] * 4 + 2) for y in range(8) for x in range(8)])
+    width, height = size
+    strip = Image.new('L', (width, 8))
+    for x in range(0, width, 8):
+        strip.paste(cell, (x, 0))
+    tile = Image.new('L', size)
+    for y in range(0, height, 8):
+        tile.paste(strip, (0, y))
+
+    tiles.clear()   # only the latest size is likely to come up again
+    tiles[size] = tile
+    return tile
+
+def fit_width(image, width=WIDTH):
+    """ Scale an image down to width (if wider), keeping its shape
+
+    Call it on a freshly opened image: a JPEG is then decoded straight
+    to greyscale at the smallest size the decoder can manage that isn't
+    below the one wanted, and only that is resampled.
+    """
+    if image.size[0] <= width:
+        return image
+    height = max(1, image.size[1] * width // image.size[0])
+    image.draft('L', (width, height))
+    if image.size[0] == width:
+        return image
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')   # what resize() handles everywhere
+    return image.resize((width, height), Image.ANTIALIAS)
+
+def convert(image, dither=None, fit=False):
+    """ A 1-bit image for the printer, scaled down to the paper if fit """
+    if fit:
+        image = fit_width(image)
+    if image.mode == '1':
+        return image
+    engine = ENGINES.get(dither or DEFAULT)
+    if engine is None:
+        raise ValueError("unknown dither '%s' (not one of %s)" % (
+                         dither, ', '.join(sorted(ENGINES))))
+    return engine(image)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Minimal event loop for the IoT printer daemon.
+#
+# Everything the daemon reacts to -- button edges from the GPIO thread,
+# timers, scheduled feeds and shutdown signals -- becomes a callback on
+# one queue, run in order on the main thread.  Other threads (and
+# signal handlers) hand work over with post(), which also writes to a
+# self-pipe so a loop sleeping in select() wakes up at once.  Timers use
+# the monotonic clock, so setting the wall clock doesn't disturb them.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import os, errno, fcntl, heapq, itertools, select, signal
+from collections import deque
+from Adafruit_Thermal import monotonic
+
+class Timer(object):
+    """ Handle for a callback scheduled with call_at/call_later """
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class EventLoop(object):
+    """ Single-threaded callback loop with thread-safe post() """
+
+    def __init__(self):
+        self.rfd, self.wfd = os.pipe()
+        for fd in (self.rfd, self.wfd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.events = deque()   # append/popleft are thread-safe
+        self.timers = []
+        self.counter = itertools.count()
+        self.running = False
+
+    def wake_on_signals(self):
+        """ Make any signal arriving wake the loop (main thread only) """
+        signal.set_wakeup_fd(self.wfd)
+
+    def post(self, callback, *args):
+        """ Queue a callback from any thread or signal handler """
+        self.events.append((callback, args))
+        try:
+            os.write(self.wfd, b'x')
+        except OSError as e:
+            if e.errno != errno.EAGAIN:   # pipe full is awake enough
+                raise
+
+    def call_soon(self, callback, *args):
+        self.events.append((callback, args))
+
+    def call_at(self, when, callback, *args):
+        """ Run a callback at a monotonic() time; returns a Timer """
+        timer = Timer(when, callback, args)
+        heapq.heappush(self.timers, (when, next(self.counter), timer))
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(monotonic() + delay, callback, *args)
+
+    def stop(self):
+        self.running = False
+
+    def timeout(self):
+        """ Seconds until the next timer (None if there isn't one) """
+        if self.events:
+            return 0
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if not self.timers:
+            return None
+        return max(0, self.timers[0][0] - monotonic())
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                select.select([self.rfd], [], [], self.timeout())
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+            try:
+                while os.read(self.rfd, 512):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+            # posted events first, then any timers that have come due
+            while self.events and self.running:
+                callback, args = self.events.popleft()
+                callback(*args)
+
+            now = monotonic()
+            while self.timers and self.timers[0][0] <= now and self.running:
+                timer = heapq.heappop(self.timers)[2]
+                if not timer.cancelled:
+                    timer.callback(*timer.args)
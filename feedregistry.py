@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Feed registry for the IoT printer.
+#
+# The feed directory is scanned once.  Each feed module is only imported
+# when it is first needed (normally when the feed is first due), since
+# some feeds decode images at import time.  Modules are loaded from
+# their file under a proper name in a 'feeds' package, so names that
+# aren't identifiers (sudoku-gfx becomes feeds.sudoku_gfx) work, and
+# nothing needs adding to sys.path.  Import times and errors are kept
+# for the startup report.
+#
+# Besides feed(), a module may have an idle(args) function for work it
+# can do ahead of time; the daemon calls it while the printer has
+# nothing else to do, once the module has been imported (or early, if
+# the feed's config says 'idle = yes').
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import os, sys, inspect, threading, traceback, types
+from Adafruit_Thermal import monotonic
+try:
+    import importlib.util as import_util
+except ImportError:
+    import imp
+    import_util = None
+
+class Feed(object):
+    """ One feed module, imported on first use """
+
+    def __init__(self, name, path, package):
+        self.name = name
+        self.path = path
+        self.module_name = package + '.' + name.replace('-', '_')
+        self.module = None
+        self.entry = None
+        self.loaded = False
+        self.import_time = None
+        self.error = None
+        self.lock = threading.Lock()   # idle work may load it off-thread
+
+    def load(self):
+        """ Import the module; returns its feed() function or None """
+        if self.loaded:
+            return self.entry
+        with self.lock:
+            if not self.loaded:
+                self.import_feed()
+                self.loaded = True
+        return self.entry
+
+    def import_feed(self):
+        start = monotonic()
+        try:
+            self.module = self.import_module()
+            entry = getattr(self.module, 'feed', None)
+            if entry is None:
+                self.error = "no feed() function"
+            elif len(inspect.getargspec(entry)[0]) != 3:
+                self.error = "feed() must take (printer, args, state)"
+            else:
+                self.entry = entry
+        except Exception:
+            self.error = traceback.format_exc().rstrip()
+        self.import_time = monotonic() - start
+
+        if self.error:
+            print("feed module '%s' failed to load: %s" % (self.name, self.error))
+
+    def import_module(self):
+        if import_util:
+            spec = import_util.spec_from_file_location(self.module_name,
+                                                       self.path)
+            module = import_util.module_from_spec(spec)
+            sys.modules[self.module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except:
+                del sys.modules[self.module_name]
+                raise
+            return module
+        return imp.load_source(self.module_name, self.path)
+
+    def spool(self):
+        """ Whether the feed's output can be recorded and spooled """
+        return getattr(self.module, 'SPOOL', True)
+
+    def idle(self):
+        """ The module's idle(args) function for background upkeep, if any """
+        return getattr(self.module, 'idle', None)
+
+    def __call__(self, printer, args, state):
+        return self.load()(printer, args, state)
+
+class FeedRegistry(object):
+    """ The feeds available in a directory, by name """
+
+    PACKAGE = "feeds"
+
+    def __init__(self, feed_dir):
+        self.feed_dir = os.path.abspath(feed_dir)
+        self.feeds = {}
+        self.scan()
+
+        # Feed modules live in a package pointing at the directory, so
+        # their imports behave as if it were a real one
+        if self.PACKAGE not in sys.modules:
+            package = types.ModuleType(self.PACKAGE)
+            package.__path__ = [self.feed_dir]
+            sys.modules[self.PACKAGE] = package
+
+    def scan(self):
+        """ Pick up feed modules added since the last scan """
+        start = monotonic()
+        for filename in os.listdir(self.feed_dir):
+            name, ext = os.path.splitext(filename)
+            if ext == ".py" and name not in self.feeds:
+                self.feeds[name] = Feed(name,
+                                        os.path.join(self.feed_dir, filename),
+                                        self.PACKAGE)
+        self.scan_time = monotonic() - start
+
+    def get(self, name):
+        """ The named feed, or None if there is no such module """
+        return self.feeds.get(name)
+
+    def names(self):
+        return sorted(self.feeds)
+
+    def report(self):
+        """ Lines describing time spent scanning and importing feeds """
+        lines = ["feed scan: %.1f ms (%d modules)" % (self.scan_time * 1000,
+                                                     len(self.feeds))]
+        for name in self.names():
+            f = self.feeds[name]
+            if not f.loaded:
+                lines.append("  %-16s not imported" % name)
+            elif f.error:
+                lines.append("  %-16s failed after %.1f ms" % (name,
+                             f.import_time * 1000))
+            else:
+                lines.append("  %-16s imported in %.1f ms" % (name,
+                             f.import_time * 1000))
+        return lines
@@ -12,10 +12,12 @@
 # http://www.adafruit.com/products/600 Printer starter pack
 
 from __future__ import print_function
-import urllib, time, textwrap
+import os, sys, time, textwrap
 from operator import itemgetter
-from xml.dom.minidom import parseString
 from unidecode import unidecode
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fetch, xmlstream
 
 def get_calendar(url, day, calname):
     try:
@@ -27,13 +29,14 @@ def get_calendar(url, day, calname):
                '&max-results=100' + \
                '&fields=entry(title,gd:when)'
 
-        dom = parseString(urllib.urlopen(url).read())
+        items = xmlstream.records(fetch.get(url), 'entry',
+                                  ['title', 'gd:when'])
 
         entries = []
-        for item in dom.getElementsByTagName('entry'):
-            title = item.getElementsByTagName('title')[0].firstChild.data
+        for item in items:
+            title = item['title'].text
 
-            start = item.getElementsByTagName('gd:when')[0].getAttribute('startTime')
+            start = item['gd:when'].get('startTime')
             start = start.split('.', 2)[0]
             if 'T' in start:
                 starttime = time.strptime(start, "%Y-%m-%dT%H:%M:%S")
@@ -101,10 +104,6 @@ def feed(printer, args, state):
     printer.feed(3)
 
 if __name__ == '__main__':
-    import os
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.sys.path.append(parent_dir)
-
     from Adafruit_Thermal import Adafruit_Thermal
     printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
 
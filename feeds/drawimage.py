@@ -13,7 +13,10 @@
 # http://www.adafruit.com/products/600 Printer starter pack
 
 from __future__ import print_function
-import Image
+import os, sys
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bitmapcache
 
 def feed(printer, args, state):
     """ Main entry point for Drawing Image """
@@ -25,20 +28,28 @@ def feed(printer, args, state):
     if not 'file' in args or not args['file']:
         return
 
+    # How to turn it into dots: @dither is 'floyd-steinberg' (the
+    # default), 'ordered' or 'threshold'; wider than the paper, it is
+    # scaled down to fit unless @fit = no (then it's cropped)
+    dither = args.get('dither') or None
+    fit = args.get('fit', 'yes').lower() not in ('no', 'false', 'off', '0')
+
+    # Converted once, then straight from the bitmap cache
     try:
-        img = Image.open(args['file'])
+        width, height, bitmap = bitmapcache.pack_file(args['file'],
+                                                      dither=dither, fit=fit)
+    except ValueError as e:
+        print("drawimage: %s" % (e))   # e.g. a bad @dither
+        return
     except:
         return
 
     # Output the image
-    printer.printImage(img, True)
+    printer.printBitmap(width, height, bitmap, True, feedBlank=True,
+                        trimMargins=True)
     printer.feed(3)
 
 if __name__ == '__main__':
-    import os
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.sys.path.append(parent_dir)
-
     from Adafruit_Thermal import Adafruit_Thermal
     printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
 
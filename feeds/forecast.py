@@ -16,38 +16,44 @@
 # http://www.adafruit.com/products/600 Printer starter pack
 
 from __future__ import print_function
-import urllib
-from xml.dom.minidom import parseString
+import os, sys
 from unidecode import unidecode
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fetch, xmlstream
 
 deg = chr(0xf8) # Degree symbol on thermal printer
 
-def gettag(dom, tag, idx):
-    return dom.getElementsByTagName(tag)[idx]
-
 def get_forecast(woeid):
     try:
-        # Fetch forecast data from Yahoo!, parse resulting XML
-        dom = parseString(urllib.urlopen(
-            'http://weather.yahooapis.com/forecastrss?w=' + woeid).read())
+        # Fetch forecast data from Yahoo!, pick out what's needed
+        # (timetemp wants the same document; a recent copy does for both)
+        tags = xmlstream.first(fetch.get(
+            'http://weather.yahooapis.com/forecastrss?w=' + woeid, ttl=600),
+            { 'description': 1, 'pubDate': 1, 'yweather:condition': 1,
+              'yweather:forecast': 2 })
+
+        cur   = tags['yweather:condition'][0]
+        today = tags['yweather:forecast'][0]
+        tomm  = tags['yweather:forecast'][1]
 
         data = {}
 
-        data['heading'] = gettag(dom,'description',0).firstChild.data
+        data['heading'] = tags['description'][0].text
 
-        data['cur-data'] = gettag(dom,'pubDate', 0).firstChild.data
-        data['cur-temp'] = gettag(dom,'yweather:condition',0).getAttribute('temp')
-        data['cur-cond'] = gettag(dom,'yweather:condition',0).getAttribute('text')
+        data['cur-data'] = tags['pubDate'][0].text
+        data['cur-temp'] = cur.get('temp')
+        data['cur-cond'] = cur.get('text')
 
-        data['today-day']  = gettag(dom,'yweather:forecast',0).getAttribute('day')
-        data['today-lo']   = gettag(dom,'yweather:forecast',0).getAttribute('low')
-        data['today-hi']   = gettag(dom,'yweather:forecast',0).getAttribute('high')
-        data['today-cond'] = gettag(dom,'yweather:forecast',0).getAttribute('text')
+        data['today-day']  = today.get('day')
+        data['today-lo']   = today.get('low')
+        data['today-hi']   = today.get('high')
+        data['today-cond'] = today.get('text')
 
-        data['tomm-day']  = gettag(dom,'yweather:forecast',1).getAttribute('day')
-        data['tomm-lo']   = gettag(dom,'yweather:forecast',1).getAttribute('low')
-        data['tomm-hi']   = gettag(dom,'yweather:forecast',1).getAttribute('high')
-        data['tomm-cond'] = gettag(dom,'yweather:forecast',1).getAttribute('text')
+        data['tomm-day']  = tomm.get('day')
+        data['tomm-lo']   = tomm.get('low')
+        data['tomm-hi']   = tomm.get('high')
+        data['tomm-cond'] = tomm.get('text')
 
         for key in data:
             data[key] = unidecode(data[key])
@@ -98,10 +104,6 @@ def feed(printer, args, state):
 
 
 if __name__ == '__main__':
-    import os
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.sys.path.append(parent_dir)
-
     from Adafruit_Thermal import Adafruit_Thermal
     printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
 
@@ -14,7 +14,10 @@
 # http://www.adafruit.com/products/600 Printer starter pack
 
 from __future__ import print_function
-import subprocess, textwrap
+import os, sys, textwrap
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import deadline
 
 def feed(printer, args, state):
     """ Main entry point for Fortune Feed """
@@ -24,7 +27,7 @@ def feed(printer, args, state):
         return
 
     try:
-        fortune = subprocess.check_output(["/usr/games/fortune", "-s"])
+        fortune = deadline.check_output(["/usr/games/fortune", "-s"])
         lines = filter(None, fortune.split('\n'))
         lines = [line.strip() for line in lines]
         text = ' '.join(lines)
@@ -44,10 +47,6 @@ def feed(printer, args, state):
 
 
 if __name__ == '__main__':
-    import os
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.sys.path.append(parent_dir)
-
     from Adafruit_Thermal import Adafruit_Thermal
     printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
 
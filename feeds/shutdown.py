@@ -7,6 +7,10 @@
 from __future__ import print_function
 import subprocess, time
 
+# Run on the printer thread once everything queued before has printed,
+# rather than pulling the plug while a goodbye message is going out
+SPOOL = False
+
 def feed(printer, args, state):
     """ Main entry point for Shutdown """
     subprocess.call("sync")
@@ -2,22 +2,104 @@
 #
 # Sudoku Generator, using 'sudoku' program
 #
+# Puzzles come from a pool kept on disk (cache/sudoku.pool), which the
+# idle() hook tops up while the printer has nothing to do, so printing
+# one doesn't wait for the generator.  The board and digits are packed
+# bitmaps (see bitmap.py), so the page is put together without PIL.
+#
 # Written by Ted M Lin.  MIT license.
 
 from __future__ import print_function
-import os, subprocess, Image
+import os, sys, json, threading
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import deadline
+from bitmap import Canvas, CACHE_DIR, load_atlas
 
 root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sudoku_file = os.path.join(root_dir, 'gfx', 'sudoku.png')
-bg = Image.open(sudoku_file)
+pool_file = os.path.join(CACHE_DIR, 'sudoku.pool')
+
+POOL_SIZE = 7   # puzzles kept ready, unless the config says (@pool)
 
 xcoord  = [ 15, 55,  95,  139, 179, 219,  263, 303, 343 ]
 ycoord  = [ 56, 96, 136,  180, 220, 260,  304, 344, 384 ]
 
-# Crop number bitmaps out of source image
-numbers = []
+# The board, and the number bitmaps to the right of it in the source image
+boxes = { 'board': (0, 0, 384, 426) }
 for i in range(9):
-  numbers.append(bg.crop([384, i*28, 410, (i+1)*28]))
+  boxes['number%d' % (i+1)] = (384, i*28, 410, (i+1)*28)
+glyphs = load_atlas('sudoku', sudoku_file, boxes)
+
+bg = glyphs['board']
+numbers = [glyphs['number%d' % (i+1)] for i in range(9)]
+
+pool_lock = threading.Lock()
+
+
+def generate(count):
+    """ New puzzles from the 'sudoku' program, as (difficulty, data) """
+    game = deadline.check_output(["/usr/games/sudoku", "-g%d" % count,
+                                  "-fcompact"])
+    puzzles = []
+    difficulty = "unknown"
+    lines = []
+    for line in filter(None, [line.strip() for line in game.split('\n')]):
+        if line.startswith('%'):
+            difficulty = line.split(' - ', 2)[1]
+            continue
+        lines.append(line)
+        if len(lines) == 9:
+            data = ''.join(lines)
+            if len(data) == 81:
+                puzzles.append((difficulty, data))
+            difficulty = "unknown"
+            lines = []
+    return puzzles
+
+def read_pool():
+    try:
+        with open(pool_file) as f:
+            return [tuple(p) for p in json.load(f)]
+    except (IOError, ValueError):
+        return []
+
+def write_pool(puzzles):
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        with open(pool_file + '.tmp', 'w') as f:
+            json.dump(puzzles, f)
+        os.rename(pool_file + '.tmp', pool_file)
+    except (IOError, OSError) as e:
+        print("sudoku: can't save puzzle pool: %s" % (e))
+
+def pool_size(args):
+    try:
+        return int(args.get('pool', POOL_SIZE))
+    except ValueError:
+        return POOL_SIZE
+
+def take_puzzle():
+    """ The next puzzle from the pool, or a fresh one if it's empty """
+    with pool_lock:
+        puzzles = read_pool()
+        if puzzles:
+            write_pool(puzzles[1:])
+            return puzzles[0]
+    puzzles = generate(1)
+    return puzzles[0] if puzzles else None
+
+def idle(args):
+    """ Top up the puzzle pool while the printer isn't busy """
+    if not isinstance(args, dict):
+        return
+    want = pool_size(args) - len(read_pool())
+    if want <= 0:
+        return
+    puzzles = generate(want)
+    with pool_lock:
+        write_pool(read_pool() + puzzles)
 
 
 def feed(printer, args, state):
@@ -31,43 +113,29 @@ def feed(printer, args, state):
         return
 
     try:
-        game = subprocess.check_output(["/usr/games/sudoku", "-g1", "-fcompact"])
-        lines = filter(None, game.split('\n'))
-        lines = [line.strip() for line in lines]
-
-        difficulty = "unknown"
-        if lines[0].startswith('%'):
-            difficulty = lines[0].split(' - ', 2)[1]
-            lines = lines[1:]
-
-        data = ''.join(lines)
+        difficulty, data = take_puzzle()
     except:
         return
     if not data or len(data) != 81:
         return
 
-    img = Image.new("1", [384, 426], "white")
-
-    img.paste(bg, (0, 0))
+    img = Canvas(384, 426, bg)
     try:
         for col in xrange(9):
             for row in xrange(9):
                 idx = row * 9 + col
                 c = data[idx]
                 if c != '.':
-                    img.paste(numbers[int(c)-1], (xcoord[col], ycoord[row]))
+                    img.paste(numbers[int(c)-1], xcoord[col], ycoord[row])
     except:
         return
 
-    #img.save("demo.jpg")
-    printer.printImage(img, True)
-    printer.println("RATING: ", difficulty) 
+    width, height, bitmap = img.pack()
+    printer.printBitmap(width, height, bitmap, True, feedBlank=True)
+    printer.println("RATING: ", difficulty)
     printer.feed(3)
 
 if __name__ == '__main__':
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.sys.path.append(parent_dir)
-
     from Adafruit_Thermal import Adafruit_Thermal
     printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
 
@@ -16,8 +16,11 @@
 # http://www.adafruit.com/products/600 Printer starter pack
 
 from __future__ import print_function
-from xml.dom.minidom import parseString
-import Image, ImageDraw, time, urllib, os
+import time, os, sys
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fetch, xmlstream
+from bitmap import Canvas, load_atlas
 
 # Although the Python Imaging Library does have nice font support,
 # I opted here to use a raster bitmap for all of the glyphs instead.
@@ -26,7 +29,6 @@ import Image, ImageDraw, time, urllib, os
 # permissive license.
 root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 symbol_file = os.path.join(root_dir, 'gfx', 'timetemp.png')
-symbols = Image.open(symbol_file)   # Bitmap w/all chars & symbols
 
 # These are the widths of certain glyphs within the 'symbols' bitmap
 TimeDigitWidth = [  38,  29,  38,  36,  40,  35,  37,  37, 38, 37, 13 ]
@@ -38,35 +40,50 @@ MonthWidth     = [  53,  52,  60,  67,  59,  63,  59,  56, 51, 48, 54, 53 ]
 DirWidth       = [  23,  35,  12,  27,  15,  33,  19,  41, 23 ]
 DirAngle       = [  23,  68, 113, 157, 203, 247, 293, 336 ]
 
-# Generate a list of sub-image glyphs cropped from the symbols image
-def croplist(widths, x, y, height):
-    cropped = []
+# Where each glyph sits in the symbols bitmap: lists of glyphs stacked
+# at (x, y) with the given widths and height, and a few odds-and-ends
+GlyphLists = { 'TimeDigit': (TimeDigitWidth,   0,   0, 44),
+               'TempDigit': (TempDigitWidth,  40,   0, 39),
+               'DateDigit': (DateDigitWidth,  75,   0, 18),
+               'HumiDigit': (HumiDigitWidth,  75, 180, 16),
+               'Day':       (DayWidth      ,  93,   0, 25),
+               'Month':     (MonthWidth    ,  93, 175, 24),
+               'Dir':       (DirWidth      , 162, 175, 21) }
+GlyphBoxes = { 'Wind':     (  93, 463, 157, 479 ),
+               'Humidity': (  93, 479, 201, 500 ),
+               'Kph':      ( 156, 366, 196, 386 ),
+               'Mph':      ( 156, 387, 203, 407 ) }
+
+for name, (widths, x, y, height) in GlyphLists.items():
     for i in range(len(widths)):
-	cropped.append(symbols.crop(
-            [x, y+i*height, x+widths[i], y+(i+1)*height]))
-    return cropped
-
-# Crop glyph lists (digits, days of week, etc.)
-TimeDigit = croplist(TimeDigitWidth,   0,   0, 44)
-TempDigit = croplist(TempDigitWidth,  40,   0, 39)
-DateDigit = croplist(DateDigitWidth,  75,   0, 18)
-HumiDigit = croplist(HumiDigitWidth,  75, 180, 16)
-Day       = croplist(DayWidth      ,  93,   0, 25)
-Month     = croplist(MonthWidth    ,  93, 175, 24)
-Dir       = croplist(DirWidth      , 162, 175, 21)
-
-# Crop a few odds-and-ends glyphs (not in lists)
-Wind      = symbols.crop([  93, 463, 157, 479 ])
-Humidity  = symbols.crop([  93, 479, 201, 500 ])
-Kph       = symbols.crop([ 156, 366, 196, 386 ])
-Mph       = symbols.crop([ 156, 387, 203, 407 ])
+        GlyphBoxes['%s%d' % (name, i)] = (x, y+i*height, x+widths[i],
+                                          y+(i+1)*height)
+
+# Cut out (or load the cached) packed glyphs
+glyphs = load_atlas('timetemp', symbol_file, GlyphBoxes)
+
+def glyphlist(name):
+    return [glyphs['%s%d' % (name, i)] for i in range(len(GlyphLists[name][0]))]
+
+TimeDigit = glyphlist('TimeDigit')
+TempDigit = glyphlist('TempDigit')
+DateDigit = glyphlist('DateDigit')
+HumiDigit = glyphlist('HumiDigit')
+Day       = glyphlist('Day')
+Month     = glyphlist('Month')
+Dir       = glyphlist('Dir')
+
+Wind      = glyphs['Wind']
+Humidity  = glyphs['Humidity']
+Kph       = glyphs['Kph']
+Mph       = glyphs['Mph']
 
 # Paste a series of glyphs (mostly numbers) from string to img
 def drawNums(img, string, x, y, glyph_list):
     for i in range(len(string)):
         d = ord(string[i]) - ord('0')
-        img.paste(glyph_list[d], (x, y))
-        x += glyph_list[d].size[0] + 1
+        img.paste(glyph_list[d], x, y)
+        x += glyph_list[d].width + 1
     return x
 
 # Determine total width of a series of glyphs in string
@@ -76,26 +93,23 @@ def numWidth(string, glyph_list):
         d = ord(string[i]) - ord('0')
         if i > 0:
             w_sum += 1 # extra space between digits
-        w_sum += glyph_list[d].size[0]
+        w_sum += glyph_list[d].width
     return w_sum
 
 def get_weather(woeid):
     try:
-        # Fetch weather data from Yahoo!, parse resulting XML
-        dom = parseString(urllib.urlopen(
-            'http://weather.yahooapis.com/forecastrss?w=' + woeid).read())
+        # Fetch weather data from Yahoo!, pick out what's needed
+        tags = xmlstream.first(fetch.get(
+            'http://weather.yahooapis.com/forecastrss?w=' + woeid, ttl=600),
+            { 'yweather:condition': 1, 'yweather:atmosphere': 1,
+              'yweather:wind': 1, 'yweather:units': 1 })
 
         # Extract values relating to current temperature, humidity, wind
-        temperature = int(dom.getElementsByTagName(
-                        'yweather:condition')[0].getAttribute('temp'))
-        humidity    = int(dom.getElementsByTagName(
-                        'yweather:atmosphere')[0].getAttribute('humidity'))
-        windSpeed   = int(dom.getElementsByTagName(
-                        'yweather:wind')[0].getAttribute('speed'))
-        windDir     = int(dom.getElementsByTagName(
-                        'yweather:wind')[0].getAttribute('direction'))
-        windUnits   = dom.getElementsByTagName(
-                        'yweather:units')[0].getAttribute('speed')
+        temperature = int(tags['yweather:condition'][0].get('temp'))
+        humidity    = int(tags['yweather:atmosphere'][0].get('humidity'))
+        windSpeed   = int(tags['yweather:wind'][0].get('speed'))
+        windDir     = int(tags['yweather:wind'][0].get('direction'))
+        windUnits   = tags['yweather:units'][0].get('speed')
 
         return (temperature, humidity, windSpeed, windDir, windUnits)
     except:
@@ -121,13 +135,12 @@ def feed(printer, args, state):
         return
     (temperature, humidity, windSpeed, windDir, windUnits) = weather
 
-    # Generate the working image
-    img  = Image.new("1", [330, 117], "white")
-    draw = ImageDraw.Draw(img)
+    # Generate the working image (packed, as the printer takes it)
+    img = Canvas(330, 117)
 
     # Draw top & bottom bars
-    draw.rectangle([42,   0, 330,   3], fill="black")
-    draw.rectangle([42, 113, 330, 116], fill="black")
+    img.rectangle(42,   0, 330,   3)
+    img.rectangle(42, 113, 330, 116)
 
     # Initial drawing position
     x = 42
@@ -143,10 +156,10 @@ def feed(printer, args, state):
     if DayWidth[t.tm_wday] > w: w = DayWidth[t.tm_wday]
 
     # Draw day-of-week and date
-    x = img.size[0] - w                    # Left alignment for two lines
-    img.paste(Day[t.tm_wday], (x, y))      # Draw day of week word
+    x = img.width - w                      # Left alignment for two lines
+    img.paste(Day[t.tm_wday], x, y)        # Draw day of week word
     y += 27                                # Next line
-    img.paste(Month[t.tm_mon - 1], (x, y)) # Draw month word
+    img.paste(Month[t.tm_mon - 1], x, y)   # Draw month word
     x += MonthWidth[t.tm_mon - 1] + 6      # Advance past month
     drawNums(img, s, x, y, DateDigit)      # Draw day of month
 
@@ -166,45 +179,43 @@ def feed(printer, args, state):
         for winDirNum in range(len(DirAngle) - 1):
             if windDir < DirAngle[winDirNum]:
                 break
-    w  = Humidity.size[0] + 5 + numWidth(s, HumiDigit)
-    w2 = Wind.size[0] + 5 + numWidth(s2, HumiDigit)
+    w  = Humidity.width + 5 + numWidth(s, HumiDigit)
+    w2 = Wind.width + 5 + numWidth(s2, HumiDigit)
     if windSpeed > 0:
-        w2 += 3 + Dir[winDirNum].size[0]
+        w2 += 3 + Dir[winDirNum].width
     if windUnits == 'kph':
-        w2 += 3 + Kph.size[0]
+        w2 += 3 + Kph.width
     else:
-        w2 += 3 + Mph.size[0]
+        w2 += 3 + Mph.width
     if w2 > w:
         w = w2
 
     # Draw humidity and wind
-    x = img.size[0] - w # Left-align the two lines
+    x = img.width - w   # Left-align the two lines
     y = 67
-    img.paste(Humidity, (x, y))
-    x += Humidity.size[0] + 5
+    img.paste(Humidity, x, y)
+    x += Humidity.width + 5
     drawNums(img, s, x, y, HumiDigit)
-    x = img.size[0] - w # Left-align again
+    x = img.width - w   # Left-align again
     y += 23             # And advance to next line
-    img.paste(Wind, (x, y))
-    x += Wind.size[0] + 5
+    img.paste(Wind, x, y)
+    x += Wind.width + 5
     if windSpeed > 0:
-        img.paste(Dir[winDirNum], (x, y))
-        x += Dir[winDirNum].size[0] + 3
+        img.paste(Dir[winDirNum], x, y)
+        x += Dir[winDirNum].width + 3
     x = drawNums(img, s2, x, y, HumiDigit) + 3
     if windUnits == 'kph':
-        img.paste(Kph, (x, y))
+        img.paste(Kph, x, y)
     else:
-        img.paste(Mph, (x, y))
+        img.paste(Mph, x, y)
 
     # Output the image
-    #img.save('timetemp_sample.jpg', "JPEG")
-    printer.printImage(img, True)
+    width, height, bitmap = img.pack()
+    printer.printBitmap(width, height, bitmap, True, feedBlank=True,
+                        trimMargins=True)
     printer.feed(3)
 
 if __name__ == '__main__':
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.sys.path.append(parent_dir)
-
     from Adafruit_Thermal import Adafruit_Thermal
     printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
 
@@ -17,8 +17,11 @@
 # http://www.adafruit.com/products/600 Printer starter pack
 
 from __future__ import print_function
-import urllib, json, HTMLParser
+import os, sys, urllib, json, HTMLParser
 from unidecode import unidecode
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fetch
 
 def feed(printer, args, state):
     """ Main entry point for Twitter Feed """
@@ -62,7 +65,7 @@ def feed(printer, args, state):
             '&rpp=' + args['max'] +
             '&since_id=' + state['lastId'] )
     try:
-        data = json.load(urllib.urlopen(url))
+        data = json.loads(fetch.get(url))
         state['lastId'] = data['max_id_str']
     except:
         return
@@ -94,10 +97,6 @@ def feed(printer, args, state):
 
 
 if __name__ == '__main__':
-    import os
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.sys.path.append(parent_dir)
-
     from Adafruit_Thermal import Adafruit_Thermal
     printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
 
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+# Shared HTTP client for the IoT printer's feeds.
+#
+#  - Connections are kept alive and reused, per host.
+#  - Responses are cached by URL, least recently used first out once
+#    the cache is over its size.  A feed says how long it is happy
+#    with a cached copy (ttl); after that the copy is revalidated with
+#    If-None-Match/If-Modified-Since where the server gave an ETag or
+#    Last-Modified, so an unchanged document costs a 304 and no body.
+#  - Feeds asking for the same URL at once share one request.
+#  - Everything runs within the caller's deadline (see deadline.py).
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import httplib, socket, threading, urlparse
+from collections import OrderedDict
+import deadline
+from Adafruit_Thermal import monotonic
+
+class HTTPError(IOError):
+    def __init__(self, url, status):
+        IOError.__init__(self, "HTTP %d fetching %s" % (status, url))
+        self.status = status
+
+class Entry(object):
+    """ A cached response """
+
+    def __init__(self, body, headers):
+        self.body = body
+        self.etag = headers.get('etag')
+        self.modified = headers.get('last-modified')
+        self.fetched = monotonic()
+
+class Client(object):
+    """ Pooled, caching HTTP GETs """
+
+    MAX_REDIRECTS = 5
+    MAX_IDLE      = 2        # idle connections kept per host
+    USER_AGENT    = "iot-printer"
+
+    def __init__(self, cache_size=1 << 20):
+        self.cache_size = cache_size   # bytes of response bodies
+        self.cache = OrderedDict()     # url -> Entry, oldest first
+        self.cached_bytes = 0
+        self.idle = {}                 # (scheme, host) -> [connection]
+        self.inflight = {}             # url -> (Event, [result, error])
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(('requests', 'hits', 'revalidated',
+                                    'coalesced', 'connects', 'reused',
+                                    'bytes'), 0)
+
+    def get(self, url, ttl=0):
+        """ The body at url, from the cache if under ttl seconds old """
+        with self.lock:
+            entry = self.cache.get(url)
+            if entry and monotonic() - entry.fetched < ttl:
+                self.cache[url] = self.cache.pop(url)   # now most recent
+                self.stats['hits'] += 1
+                return entry.body
+
+            # someone else already fetching it?
+            waiting = self.inflight.get(url)
+            if waiting is None:
+                mine = self.inflight[url] = (threading.Event(), [None, None])
+            else:
+                self.stats['coalesced'] += 1
+
+        if waiting:
+            done, result = waiting
+            done.wait(deadline.remaining())
+            if not done.is_set():
+                deadline.expire()
+            if result[1]:
+                raise result[1]
+            return result[0]
+
+        done, result = mine
+        try:
+            result[0] = self.refresh(url, entry)
+            return result[0]
+        except Exception as e:
+            result[1] = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[url]
+            done.set()
+
+    def refresh(self, url, entry):
+        """ Fetch url, revalidating a cached entry if there is one """
+        headers = {}
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.modified:
+            headers['If-Modified-Since'] = entry.modified
+
+        location = url
+        for i in range(self.MAX_REDIRECTS + 1):
+            status, reply, body = self.request(location, headers)
+            if status in (301, 302, 303, 307, 308) and 'location' in reply:
+                location = urlparse.urljoin(location, reply['location'])
+                continue
+            break
+
+        if status == 304 and entry:
+            with self.lock:
+                self.stats['revalidated'] += 1
+                entry.fetched = monotonic()
+                if url in self.cache:
+                    self.cache[url] = self.cache.pop(url)
+            return entry.body
+        if status != 200:
+            raise HTTPError(url, status)
+
+        self.store(url, Entry(body, reply))
+        return body
+
+    def store(self, url, entry):
+        with self.lock:
+            old = self.cache.pop(url, None)
+            if old:
+                self.cached_bytes -= len(old.body)
+            if len(entry.body) > self.cache_size:
+                return
+            self.cache[url] = entry
+            self.cached_bytes += len(entry.body)
+            while self.cached_bytes > self.cache_size:
+                url, old = self.cache.popitem(last=False)
+                self.cached_bytes -= len(old.body)
+
+    def request(self, url, headers):
+        """ One GET; returns (status, lower-cased headers, body) """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers, **{'User-Agent': self.USER_AGENT})
+
+        # A reused connection may have been closed by the server while
+        # idle, which only shows up when we try it; go again on a new one
+        while True:
+            timeout = deadline.remaining()   # before a connection is taken
+            conn, reused = self.connection(key)
+            try:
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except socket.timeout:
+                conn.close()
+                deadline.expire()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += len(body)
+        reply = dict((k.lower(), v) for k, v in response.getheaders())
+        if response.will_close:
+            conn.close()
+        else:
+            self.release(key, conn)
+        return response.status, reply, body
+
+    def connection(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                self.stats['reused'] += 1
+                return idle.pop(), True
+            self.stats['connects'] += 1
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc), False
+        return httplib.HTTPConnection(netloc), False
+
+    def release(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.MAX_IDLE:
+                idle.append(conn)
+                return
+        conn.close()
+
+# The one client all the feeds share
+client = Client()
+
+def get(url, ttl=0):
+    return client.get(url, ttl)
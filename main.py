@@ -17,10 +17,25 @@
 # http://www.adafruit.com/products/600 Printer starter pack
 
 from __future__ import print_function
-import sys, os, signal, time, inspect
+import sys, os, signal, time, copy
+from collections import deque
+from itertools import islice
 from ConfigParser import RawConfigParser
-import RPi.GPIO as GPIO
-from Adafruit_Thermal import Adafruit_Thermal
+from multiprocessing.pool import ThreadPool
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None   # not on a Pi; see --simulate
+from Adafruit_Thermal import Adafruit_Thermal, monotonic
+from printjob import JobRecorder
+from spooler import Spooler
+from scheduler import Scheduler, next_at
+from eventloop import EventLoop
+from feedregistry import FeedRegistry
+from statestore import StateStore
+from metrics import Metrics, FeedRun
+import deadline, fetch, bitmapcache
+from deadline import DeadlineExceeded
 
 class PrintManager(object):
     LED_PIN    = 18
@@ -31,125 +46,241 @@ class PrintManager(object):
 
     FEED_DIR    = "feeds"
     CONFIG_FILE = "run.cfg"
+    SETTINGS    = "settings"  # config section that isn't a feed
+    CONFIG_POLL = 5           # seconds between checks for config changes
+    STATE_FILE  = "state.json"  # where feeds' state is kept between runs
+    MODES = ('start', 'stop', 'hold', 'tap', 'interval', 'at')
 
     RUN_SCHEDULED_AT_START = True
 
-    def __init__(self):
-        # Initialize printer interface
-        self.printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
+    MAX_SLEEP   = 60  # seconds between clock checks when idle
+    CLOCK_SLACK = 2   # seconds the clock may step back before rescheduling
+
+    SPOOL_JOBS = 4   # print jobs allowed to queue up for the printer
+
+    PREPARE_THREADS = 4   # feeds due together are rendered in parallel
+    FEED_TIMEOUT    = 60  # seconds a feed has unless its config says
+
+    HTTP_CACHE_SIZE = 1 << 20  # bytes of fetched documents kept
+    BITMAP_CACHE_SIZE = 4 << 20  # bytes of converted images kept on disk
+
+    STALE = 900   # seconds a prefetched job stays good for by default
+
+    LATENCY_SAMPLES = 100  # taps to keep timing statistics for
+
+    IDLE_INTERVAL = 60   # seconds between goes at feeds' idle() work
+
+    def __init__(self, printer=None, gpio=None):
+        self.startup = [('start', monotonic())]
+        self.first_byte = None
+
+        # Initialize printer interface (unless given, e.g. a simulated one)
+        if printer is None:
+            printer = Adafruit_Thermal("/dev/ttyAMA0", 19200, timeout=5)
+        self.printer = printer
+        self.gpio = gpio or GPIO
+
+        # Printer-owner thread; feeds are rendered into print jobs which
+        # it works through while the next feeds are being fetched
+        self.spooler = Spooler(self.printer, self.SPOOL_JOBS,
+                               on_busy=self.led_on, on_idle=self.printer_idle,
+                               on_start=self.job_started,
+                               on_done=self.job_done)
+        self.spool_state = None
+        self.prepare_threads = self.PREPARE_THREADS
+        self.feed_timeout = self.FEED_TIMEOUT
+        self.pool = None
+        self.pending = deque()   # feeds being prepared, in print order
+        self.idle_busy = False   # feeds' idle() work under way
+        self.idle_last = None    # monotonic() time it was last started
+        self.idle_timer = None
 
         # Use Broadcom pin numbers (not Raspberry Pi pin numbers) for GPIO
-        GPIO.setmode(GPIO.BCM)
+        self.gpio.setmode(self.gpio.BCM)
 
         # Enable LED and button (w/pull-up on latter)
-        GPIO.setup(self.LED_PIN, GPIO.OUT)
-        GPIO.setup(self.BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        self.gpio.setup(self.LED_PIN, self.gpio.OUT)
+        self.gpio.setup(self.BUTTON_PIN, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
 
-        # Setup button handling
-        self.button_hold = None
-        self.button_tap = None
-        self.prev_button_state = (GPIO.input(self.BUTTON_PIN), time.time())
-        GPIO.add_event_detect(self.BUTTON_PIN, GPIO.BOTH, callback=self.button_handler)
+        # Setup button handling; edges are picked up on the GPIO thread
+        # and handed to the event loop, which does all the work
+        self.loop = EventLoop()
+        self.button_down = None    # monotonic time of the last press
+        self.button_held = False
+        self.hold_timer = None
+        self.gpio.add_event_detect(self.BUTTON_PIN, self.gpio.BOTH, callback=self.button_handler)
 
-        # Feed module manager
-        sys.path.append(self.FEED_DIR)
-        self.feeds = {}
+        # Tap to first printer byte, for the last few taps
+        self.tap_latency = deque(maxlen=self.LATENCY_SAMPLES)
+
+        # Feed modules, imported when first needed
+        self.feeds = FeedRegistry(self.FEED_DIR)
 
         # Feed runtime configuration
-        self.run_start = []
-        self.run_stop = []
-        self.run_tap = []
-        self.run_hold = []
-        self.run_interval = []
-        self.run_when = []
+        self.config_stamp = None
+        self.store = StateStore(self.STATE_FILE)
+        self.metrics = Metrics()
+        self.set_feeds([])
+        self.schedule = Scheduler()
+        self.schedule_timer = None
+        self.last_check = None
 
         # register some signal handlers
         self.terminate = False
-        signal.signal(signal.SIGALRM, self.signal_handler)
         signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGHUP, self.signal_handler)
 
     def cleanup(self):
-        GPIO.cleanup()
+        self.gpio.cleanup()
 
     def led_on(self):
-        GPIO.output(self.LED_PIN, GPIO.HIGH)
+        self.gpio.output(self.LED_PIN, self.gpio.HIGH)
 
     def led_off(self):
-        GPIO.output(self.LED_PIN, GPIO.LOW)
+        self.gpio.output(self.LED_PIN, self.gpio.LOW)
+
+    def printer_idle(self):
+        """ Printer thread: the spooler has run out of jobs """
+        self.led_off()
+        self.loop.post(self.run_idle)
 
     def signal_handler(self, signum, frame):
-        """ Handle ctrl-c and button events """
+        """ Handle ctrl-c, and SIGHUP to reload the config """
         if signum == signal.SIGINT:
-            self.terminate = True
-        elif signum == signal.SIGALRM:
-            self.button_handler(self.BUTTON_PIN)
+            self.loop.post(self.shutdown)
+        elif signum == signal.SIGHUP:
+            self.loop.post(self.reload_config)
+
+    def shutdown(self):
+        self.terminate = True
+        self.loop.stop()
 
     def button_handler(self, channel):
-        """ Handle the button tap/hold states """
+        """ GPIO thread: pass button edges on to the event loop """
         if channel != self.BUTTON_PIN:
             return
+        self.loop.post(self.button_event, self.gpio.input(self.BUTTON_PIN),
+                       monotonic())
 
-        state = GPIO.input(self.BUTTON_PIN)
-        now = time.time()
-        delta = now - self.prev_button_state[1]
-
-        if self.prev_button_state[0] != state:
-            self.prev_button_state = (state, now)
-
-            if state == GPIO.HIGH:
-                self.button_hold = None
+    def button_event(self, state, now):
+        """ Work out taps and holds from button edges """
+        if self.terminate:
+            return
+        if state == self.gpio.LOW:
+            if self.button_down is not None:
+                return
+            self.button_down = now
+            self.button_held = False
+            self.hold_timer = self.loop.call_at(now + self.HOLD_TIME,
+                                                self.button_hold)
+        else:
+            if self.button_down is None:
+                return
+            delta = now - self.button_down
+            self.button_down = None
+            if self.hold_timer:
+                self.hold_timer.cancel()
+                self.hold_timer = None
+
+            # debounce the button tap and trigger action
+            if not self.button_held and delta > self.TAP_TIME:
+                self.do_jobs(self.run_tap, now)
+
+    def button_hold(self):
+        """ Button still down after HOLD_TIME """
+        self.hold_timer = None
+        if self.button_down is not None:
+            self.button_held = True
+            self.do_jobs(self.run_hold)
+
+    def job_started(self, job):
+        """ Printer thread: a job has been taken off the spool """
+        if self.pending:
+            self.loop.post(self.flush_jobs)   # there's room in the spool now
+
+    def job_done(self, job, seconds, error):
+        """ Printer thread: a job is out, so its feed's state can be kept
+
+        Also notes how long a tap took to reach the printer, up to the
+        job's first byte going out.
+        """
+        first = getattr(job, 'firstByte', None)
+        if first is not None:
+            if self.first_byte is None:
+                self.first_byte = first
+            trigger = getattr(job, 'trigger', None)
+            if trigger is not None:
+                self.tap_latency.append(first - trigger)
+        run = getattr(job, 'run', None)
+        if run:
+            run.phases['transmit'] = seconds
+            if error and not run.error:
+                run.fail(error)
+            self.metrics.record(run)
+        saved = getattr(job, 'saved_state', None)
+        if saved and not error:
+            self.store.put(*saved)
+
+    def latency_report(self):
+        """ Summary of tap-to-first-byte times (seconds) """
+        samples = sorted(self.tap_latency)
+        if not samples:
+            return "tap latency: no taps"
+        return "tap latency: min %.3f median %.3f max %.3f (%d taps)" % (
+            samples[0], samples[len(samples) // 2], samples[-1], len(samples))
+
+    def startup_report(self):
+        """ Lines showing where the time to the first printout went """
+        marks = list(self.startup)
+        if self.first_byte is not None:
+            marks.append(('first byte', self.first_byte))
+        marks.sort(key=lambda m: m[1])
+
+        lines = []
+        for (name, t), (prev, t0) in zip(marks[1:], marks):
+            lines.append("%-16s +%.1f ms" % (name, (t - t0) * 1000))
+        return lines + self.feeds.report()
+
+    def read_config(self):
+        """ Parse the config file into settings and a list of feed items """
+        config = RawConfigParser()
+        config.read(self.CONFIG_FILE)
 
-                # debounce the button tap and trigger action
-                if delta > self.TAP_TIME and self.button_tap is None:
-                    self.button_tap = True
-                    os.kill(os.getpid(), signal.SIGALRM)
-            else:
-                self.button_tap = None
-
-                # schedule a hold check
-                signal.alarm(int(self.HOLD_TIME))
-
-        elif state == GPIO.LOW:
-            if delta >= self.HOLD_TIME and self.button_hold is None:
-                self.button_hold = True
-                self.button_tap = False
-
-    def feed_loader(self, feed_name):
-        """ Import the module and get the handler function """
-        if feed_name in self.feeds:
-            return self.feeds[feed_name]
-        for filename in os.listdir(self.FEED_DIR):
-            name, ext = os.path.splitext(filename)
-            if ext == ".py" and name == feed_name:
-                # remember, this can fail if script overlays existing module
+        settings = {}
+        if config.has_option(self.SETTINGS, 'prepare_threads'):
+            try:
+                settings['prepare_threads'] = max(1, config.getint(
+                    self.SETTINGS, 'prepare_threads'))
+            except:
+                print("settings has invalid 'prepare_threads' value")
+        for option in ('http_cache_size', 'bitmap_cache_size'):
+            if config.has_option(self.SETTINGS, option):
                 try:
-                    mod = __import__(feed_name)
-                    if hasattr(mod, "feed"):
-                        spec = inspect.getargspec(mod.feed)
-                        if len(spec[0]) != 3:
-                            continue
-                        self.feeds[feed_name] = mod.feed
-                        return mod.feed
+                    settings[option] = config.getint(self.SETTINGS, option)
                 except:
-                    pass
-        return None
-
-    def load_config(self):
-        """ Read the config file for feeds to run """
-        now = time.localtime()
-        now_time = now.tm_hour * 60 + now.tm_min
-
-        config = RawConfigParser()
-        config.read(self.CONFIG_FILE)
+                    print("settings has invalid '%s' value" % (option))
+        for option in ('feed_timeout', 'prefetch', 'stale'):
+            if config.has_option(self.SETTINGS, option):
+                try:
+                    settings[option] = config.getfloat(self.SETTINGS, option)
+                except:
+                    print("settings has invalid '%s' value" % (option))
+        for option in ('state_file', 'metrics_file', 'status_file'):
+            if config.has_option(self.SETTINGS, option):
+                settings[option] = config.get(self.SETTINGS, option)
+
+        items = []
+        for order, s in enumerate(config.sections()):
+            if s == self.SETTINGS:
+                continue
 
-        for s in config.sections():
             if not config.has_option(s, 'feed'):
                 print("feed '%s' missing 'feed' identifier" % (s))
                 continue
 
-            feed = self.feed_loader(config.get(s, 'feed'))
+            feed = self.feeds.get(config.get(s, 'feed'))
             if not feed:
-                print("feed '%s' could not load module '%s'" % (s, config.get(s, 'feed')))
+                print("feed '%s' could not find module '%s'" % (s, config.get(s, 'feed')))
                 continue
 
             if not config.has_option(s, 'mode'):
@@ -161,18 +292,29 @@ class PrintManager(object):
             for o in filter(lambda x: x.startswith('@'), config.options(s)):
                 args[o[1:]] = config.get(s, o)
 
-            feed_item = {'id':s, 'feed':feed, 'args':args, 'state':{}}
+            # state is looked up when the feed first runs
+            feed_item = {'id':s, 'feed':feed, 'args':args, 'state':None,
+                         'order':order, 'mode':mode}
+
+            if config.has_option(s, 'timeout'):
+                try:
+                    feed_item['timeout'] = config.getfloat(s, 'timeout')
+                except:
+                    print("feed '%s' has invalid 'timeout' value" % (s))
+                    continue
+
+            # has idle() work worth importing the module early for
+            if config.has_option(s, 'idle'):
+                try:
+                    feed_item['idle'] = config.getboolean(s, 'idle')
+                except:
+                    print("feed '%s' has invalid 'idle' value" % (s))
+                    continue
 
             if mode == 'off':
+                continue
+            elif mode in ('start', 'stop', 'hold', 'tap'):
                 pass
-            elif mode == 'start':
-                self.run_start.append(feed_item)
-            elif mode == 'stop':
-                self.run_stop.append(feed_item)
-            elif mode == 'hold':
-                self.run_hold.append(feed_item)
-            elif mode == 'tap':
-                self.run_tap.append(feed_item)
             elif mode == 'interval':
                 if not config.has_option(s, 'interval'):
                     print("feed '%s' missing 'interval' value" % (s))
@@ -182,9 +324,6 @@ class PrintManager(object):
                 except:
                     print("feed '%s' has invalid 'interval' value" % (s))
                     continue
-
-                feed_item['next'] = 0
-                self.run_interval.append(feed_item)
             elif mode == 'at':
                 if not config.has_option(s, 'when'):
                     print("feed '%s' missing 'at' value" % (s))
@@ -196,85 +335,498 @@ class PrintManager(object):
                     print("feed '%s' has invalid 'at' value" % (s))
                     continue
 
-                if feed_item['when'] > now_time or self.RUN_SCHEDULED_AT_START:
-                    feed_item['ran_today'] = False
-                else:
-                    feed_item['ran_today'] = True
-
-                self.run_when.append(feed_item)
+                # how far ahead to get the job ready, and how old it
+                # may be when printed
+                feed_item['prefetch'] = settings.get('prefetch', 0)
+                feed_item['stale'] = settings.get('stale', self.STALE)
+                try:
+                    for option in ('prefetch', 'stale'):
+                        if config.has_option(s, option):
+                            feed_item[option] = config.getfloat(s, option)
+                except:
+                    print("feed '%s' has invalid '%s' value" % (s, option))
+                    continue
             else:
                 print("feed '%s' has bad 'mode' value '%s'" % (s, mode))
                 continue
 
+            items.append(feed_item)
+
+        return settings, items
+
+    def load_config(self):
+        """ Read the config file for feeds to run """
+        self.config_stamp = self.config_changed()
+        settings, items = self.read_config()
+        self.prepare_threads = settings.get('prepare_threads',
+                                            self.PREPARE_THREADS)
+        if 'state_file' in settings:
+            self.store = StateStore(settings['state_file'])
+        self.apply_settings(settings)
+        self.set_feeds(items)
+        self.startup.append(('config', monotonic()))
+
+    def set_feeds(self, items):
+        """ Sort feed items into the lists for each way they are run """
+        self.items = items
+        by_mode = dict((mode, []) for mode in self.MODES)
+        for f in items:
+            by_mode[f['mode']].append(f)
+        self.run_start = by_mode['start']
+        self.run_stop = by_mode['stop']
+        self.run_hold = by_mode['hold']
+        self.run_tap = by_mode['tap']
+        self.run_interval = by_mode['interval']
+        self.run_when = by_mode['at']
+
+    def apply_settings(self, settings):
+        """ Settings that can change while running """
+        self.feed_timeout = settings.get('feed_timeout', self.FEED_TIMEOUT)
+        self.metrics.textfile = settings.get('metrics_file')
+        self.metrics.statusfile = settings.get('status_file')
+        fetch.client.cache_size = settings.get('http_cache_size',
+                                               self.HTTP_CACHE_SIZE)
+        bitmapcache.cache.max_bytes = settings.get('bitmap_cache_size',
+                                                   self.BITMAP_CACHE_SIZE)
+
+    @staticmethod
+    def definition(f):
+        """ What a feed item was configured as (less its place in the file) """
+        return (f['feed'], f['mode'], sorted(f['args'].items()),
+                f.get('interval'), f.get('when'), f.get('timeout'),
+                f.get('idle'),
+                f.get('prefetch'), f.get('stale'))
+
+    def config_changed(self):
+        """ Something that changes whenever the config file does """
+        try:
+            st = os.stat(self.CONFIG_FILE)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def watch_config(self):
+        """ Reload the config file if it has been written to """
+        if self.config_changed() != self.config_stamp:
+            self.reload_config()
+        self.loop.call_later(self.CONFIG_POLL, self.watch_config)
+
+    def reload_config(self):
+        """ Re-read the config file, changing only the feeds that changed
+
+        Unchanged feeds carry on as they were (schedule and state); feeds
+        whose module and arguments stay the same keep their state.  New
+        'start' feeds don't run until the next start, and a new state_file
+        is only used after a restart.  Anything already handed to the
+        spooler prints as normal.
+        """
+        began = monotonic()
+        self.config_stamp = self.config_changed()
+        self.feeds.scan()
+        try:
+            settings, items = self.read_config()
+        except Exception as e:
+            print("config reload failed, keeping current feeds: %s" % e)
+            return
+
+        now = time.time()
+        old = dict((f['id'], f) for f in self.items)
+        merged = []
+        added = changed = 0
+        for f in items:
+            prev = old.pop(f['id'], None)
+            prev_due = prev and prev.get('due')
+            if prev and self.definition(prev) == self.definition(f):
+                prev['order'] = f['order']
+                merged.append(prev)
+                continue
+
+            if prev:
+                changed += 1
+                self.schedule.cancel(prev)
+                if prev['feed'] is f['feed'] and prev['args'] == f['args']:
+                    f['state'] = prev['state']
+                else:
+                    f['state'] = {}
+            else:
+                added += 1
+
+            if 'interval' in f and prev and prev.get('interval') and \
+               prev_due is not None:
+                # keep to the last run, at the new interval
+                self.schedule.schedule(f, max(now, prev_due -
+                                       prev['interval'] + f['interval']))
+            elif 'interval' in f or 'when' in f:
+                self.schedule_feed(f, now, 'interval' in f)
+            merged.append(f)
+
+        for f in old.values():
+            self.schedule.cancel(f)
+        self.set_feeds(merged)
+
+        self.apply_settings(settings)
+        threads = settings.get('prepare_threads', self.PREPARE_THREADS)
+        if threads != self.prepare_threads:
+            # the old pool finishes off anything it was given first
+            self.prepare_threads = threads
+            self.pool.close()
+            self.pool = ThreadPool(threads)
+
+        # pick up the new deadlines, and any new idle work
+        self.loop.call_soon(self.run_scheduled)
+        self.loop.call_soon(self.run_idle)
+
+        print("reloaded %s: %d added, %d changed, %d removed in %.1f ms" % (
+              self.CONFIG_FILE, added, changed, len(old),
+              (monotonic() - began) * 1000))
+
     def run(self):
         """ Main loop that processing feeds """
+        self.pool = ThreadPool(self.prepare_threads)
+        self.spooler.start()
+        self.loop.wake_on_signals()
+
         # starting program, run hello feeds
         self.do_jobs(self.run_start)
+        self.startup.append(('start feeds', monotonic()))
 
-        while not self.terminate:
-            now = time.localtime()
-            now_time = now.tm_hour * 60 + now.tm_min
-
-            # next run is at most 30sec away
-            next_run = 30
-
-            # button hold triggered
-            if self.button_hold:
-                self.button_hold = False
-                self.do_jobs(self.run_hold)
-
-            # button tap triggered
-            if self.button_tap:
-                self.button_tap = False
-                self.do_jobs(self.run_tap)
-
-            # look for scheduled feeds to run
-            when_tasks = []
-            for t in self.run_when:
-                if t['when'] <= now_time:
-                    if not t['ran_today']:
-                        t['ran_today'] = True
-                        when_tasks.append(t)
-                else:
-                    t['ran_today'] = False
-            self.do_jobs(when_tasks)
-
-            # look for interval feeds to run
-            interval_tasks = []
-            for t in self.run_interval:
-                if t['next'] <= time.mktime(now):
-                    t['next'] = time.mktime(now) + t['interval']
-                    interval_tasks.append(t)
-                if time.mktime(now) - t['next'] < next_run:
-                    next_run = time.mktime(now) - t['next']
-
-            self.do_jobs(interval_tasks)
-
-            # wait until we have work to do
-            if next_run >= 1:
-                signal.alarm(next_run)
-                signal.pause()
-            else:
-                time.sleep(0.25)
+        self.last_check = time.time()
+        self.schedule_feeds(self.last_check, True)
+        self.loop.call_soon(self.run_scheduled)
+        self.loop.call_later(self.CONFIG_POLL, self.watch_config)
+        self.loop.run()
 
-        # quitting program, run stop feeds
+        # quitting program, run stop feeds (after anything pending)
         self.do_jobs(self.run_stop)
-
-    def do_jobs(self, feeds):
-        if not feeds:
+        if self.pending:
+            self.loop.run()
+        self.spooler.stop()
+        self.pool.terminate()
+        print(self.latency_report())
+
+    def run_scheduled(self):
+        """ Run the periodic and timed feeds that are due """
+        if self.terminate:
             return
 
-        self.led_on()
+        # work out everything again if the clock was set back
+        now = time.time()
+        if now < self.last_check - self.CLOCK_SLACK:
+            self.schedule_feeds(now)
+        self.last_check = now
+
+        # run whatever is due (in config order), and line up the
+        # next run of each; 'at' feeds coming up early are prefetching
+        tasks = []
+        for t in self.schedule.pop_due(now):
+            if t.get('print_at', now) > now:
+                self.prefetch(t)
+                self.schedule.schedule(t, t['print_at'])
+            else:
+                self.schedule_feed(t, now)
+                tasks.append(t)
+        self.do_jobs(sorted(tasks, key=lambda t: t['order']))
+
+        # come back at the next deadline; wake up now and then anyway
+        # to notice wall clock changes
+        delay = self.MAX_SLEEP
+        next_run = self.schedule.next_due()
+        if next_run is not None:
+            delay = min(delay, next_run - time.time())
+        if self.schedule_timer:
+            self.schedule_timer.cancel()
+        self.schedule_timer = self.loop.call_later(max(delay, 0),
+                                                   self.run_scheduled)
+
+    def schedule_feed(self, f, now, starting=False):
+        """ Put a periodic or timed feed on the schedule for its next run """
+        if 'interval' in f:
+            if starting:
+                self.schedule.schedule(f, now)
+            else:
+                self.schedule.schedule(f, now + f['interval'])
+        else:
+            # come up for a prefetch first if there's time for one
+            f['print_at'] = next_at(f['when'], now,
+                                    starting and self.RUN_SCHEDULED_AT_START)
+            if f['prefetch'] and f['print_at'] > now:
+                self.schedule.schedule(f, max(now, f['print_at'] -
+                                                   f['prefetch']))
+            else:
+                self.schedule.schedule(f, f['print_at'])
+
+    def schedule_feeds(self, now, starting=False):
+        """ Schedule every periodic and timed feed from scratch """
+        self.schedule.clear()
+        for f in self.run_when + self.run_interval:
+            self.schedule_feed(f, now, starting)
+
+    def do_jobs(self, feeds, trigger=None):
+        """ Render feeds into print jobs and hand them to the spooler
+
+        trigger is the monotonic() time of the button tap (if any) that
+        asked for these, to time how long it takes to start printing.
+        """
+        # All feeds due together are rendered at the same time on the
+        # thread pool, but spooled strictly in the order given (after
+        # any still pending from before).  They all start out from the
+        # same printer state, which is fine as feeds put back any text
+        # modes they change.  Nothing here waits: each job is spooled
+        # from flush_jobs() as the ones before it are ready, and a feed
+        # that runs past its time budget is given up on.  The budgets
+        # all count from the same moment, so the batch as a whole is
+        # over by then plus the longest of them, however many feeds
+        # there are.
+        started = monotonic()
         for f in feeds:
+            entry = self.prefetched(f) or self.start_job(f, started)
+            if entry:
+                entry['trigger'] = trigger
+                self.pending.append(entry)
+        self.flush_jobs()
+
+    def start_job(self, f, started=None):
+        """ Start preparing a feed; returns its entry for self.pending
+
+        Its time budget counts from monotonic() time 'started' (now if
+        not given).
+        """
+        # import the module the first time the feed is needed
+        if not f['feed'].load():
+            return None
+        if f['state'] is None:
+            f['state'] = self.store.get(f['id'])
+
+        entry = {'feed':f, 'job':None, 'trigger':None}
+
+        # Feeds with SPOOL = False (e.g. shutdown) have side effects
+        # that must wait for earlier output, so they run in order on
+        # the printer thread against the real printer instead
+        if not f['feed'].spool():
+            entry['ready'] = True
+            return entry
+
+        # The run works on its own copy of the feed's state, which only
+        # replaces the feed's when its job is taken (see flush_jobs); one
+        # given up on can carry on in the background without touching it
+        entry['ready'] = False
+        when = (started or monotonic()) + f.get('timeout', self.feed_timeout)
+        entry['timer'] = self.loop.call_at(when, self.job_timeout, entry)
+        self.pool.apply_async(self.prepare,
+                              (f, copy.deepcopy(f['state']),
+                               self.spool_state, when),
+                              callback=lambda job, entry=entry:
+                                  self.loop.post(self.job_ready, entry, job))
+        return entry
+
+    def prefetch(self, f):
+        """ Get an 'at' feed's job ready ahead of its time """
+        if f['feed'].load() and f['feed'].spool():
+            f['prefetched'] = self.start_job(f)
+
+    def prefetched(self, f):
+        """ The entry prefetched for a feed, if it is still any use
+
+        One still being prepared is waited for; one that failed, came
+        out empty or is older than the feed's 'stale' limit is dropped
+        so the feed is fetched again now.
+        """
+        entry = f.pop('prefetched', None)
+        if entry and entry['ready']:
+            job = entry['job']
+            if not job or job.run.error or \
+               monotonic() - entry['ready_at'] > f['stale']:
+                return None
+        return entry
+
+    def job_ready(self, entry, job):
+        """ A feed has been rendered """
+        if entry['ready']:
+            return   # too late, already given up on
+        entry['timer'].cancel()
+        entry['ready'] = True
+        entry['ready_at'] = monotonic()
+        entry['job'] = job
+        self.flush_jobs()
+
+    def job_timeout(self, entry):
+        """ A feed has run out of time; carry on without it """
+        if entry['ready']:
+            return
+        entry['ready'] = True
+        run = FeedRun(entry['feed']['id'])
+        run.fail(DeadlineExceeded())
+        self.metrics.record(run)
+        self.flush_jobs()
+
+    def flush_jobs(self):
+        """ Spool the jobs at the head of the line that are ready """
+        # The spooler is never waited on: when it's full, the rest stay
+        # here until it starts on its next job (see job_started)
+        while self.pending and self.pending[0]['ready']:
+            entry = self.pending[0]
+            f = entry['feed']
+            job = entry['job']
+            if not f['feed'].spool():
+                job = lambda printer, f=f: self.run_direct(printer, f)
+            elif job is None:
+                self.pending.popleft()   # timed out
+                continue
+            elif not job:
+                self.pending.popleft()
+                if not job.run.error:
+                    f['state'] = job.feed_state
+                self.metrics.record(job.run)   # nothing to print
+                continue
+            else:
+                if not job.run.error:
+                    f['state'] = job.feed_state
+                job.trigger = entry['trigger']
+                for e in islice(self.pending, 1, None):   # only time the
+                    if e['trigger'] == job.trigger:       # first job
+                        e['trigger'] = None
+                if not job.run.error:
+                    job.saved_state = (f['id'],
+                                       StateStore.encode(f['state']))
+            if not self.spooler.offer(job):
+                break
+            self.pending.popleft()
+            if f['feed'].spool():
+                self.spool_state = job.state
+
+        if self.terminate and not self.pending:
+            self.loop.stop()
+        elif not self.pending:
+            self.loop.call_soon(self.run_idle)
+
+    def run_idle(self):
+        """ Give feeds with idle() work a turn, if nothing else is going on
+
+        Only feeds already imported (having run) or configured with
+        'idle = yes' are asked, and at most every IDLE_INTERVAL seconds.
+        """
+        if self.terminate or self.idle_busy or self.pending or \
+           not self.spooler.idle():
+            return
+        if self.idle_last is not None:
+            wait = self.idle_last + self.IDLE_INTERVAL - monotonic()
+            if wait > 0:
+                if not self.idle_timer:
+                    self.idle_timer = self.loop.call_later(wait,
+                                                           self.idle_retry)
+                return
+
+        items = [f for f in self.items if f['feed'].loaded or f.get('idle')]
+        if not items:
+            return
+        self.idle_busy = True
+        self.idle_last = monotonic()
+        self.pool.apply_async(self.idle_work, (items,),
+                              callback=lambda result:
+                                  self.loop.post(self.idle_done))
+
+    def idle_retry(self):
+        self.idle_timer = None
+        self.run_idle()
+
+    def idle_done(self):
+        self.idle_busy = False
+
+    def idle_work(self, items):
+        """ Pool thread: run each feed's idle() hook, within its time budget """
+        for f in items:
+            if self.terminate:
+                break
+            if not f['feed'].load() or not f['feed'].idle():
+                continue
+            budget = f.get('timeout', self.feed_timeout)
+            with deadline.until(monotonic() + budget):
+                try:
+                    f['feed'].idle()(f['args'])
+                except Exception as e:
+                    print("feed '%s' idle work failed: %r" % (f['id'], e))
+
+    def run_direct(self, printer, f):
+        """ Printer thread: run a feed that can't be spooled """
+        run = FeedRun(f['id'])
+        start = monotonic()
+        try:
+            f['feed'](printer, f['args'], f['state'])
+        except Exception as e:
+            run.fail(e)
+        run.phases['transmit'] = monotonic() - start
+        self.metrics.record(run)
+        if not run.error:
+            self.store.put(f['id'], StateStore.encode(f['state']))
+
+    def prepare(self, f, feed_state, state, when):
+        """ Run a feed against a recorder, returning its print job
+
+        The feed runs with feed_state (a copy of its state, which ends up
+        as job.feed_state) and printer state 'state', and has until
+        monotonic() time 'when'.  The job's run (a FeedRun) has the
+        prepare and render times; a feed that raises still has what it
+        printed so far spooled.
+        """
+        run = FeedRun(f['id'])
+        recorder = JobRecorder(self.printer, state)
+        start = monotonic()
+        with deadline.until(when) as budget:
             try:
-                f['feed'](self.printer, f['args'], f['state'])
-            except:
-                pass
-        self.led_off()
+                f['feed'](recorder, f['args'], feed_state)
+            except Exception as e:
+                run.fail(e)
+        if budget.hit and not run.error:
+            run.fail(DeadlineExceeded())   # the feed hid it
+        end = monotonic()
+        first = recorder.firstWrite or end
+        run.phases['prepare'] = first - start
+        run.phases['render'] = end - first
+
+        job = recorder.finish()
+        run.measure(job)
+        job.run = run
+        job.feed_state = feed_state
+        return job
 
 
 if __name__ == '__main__':
-    p = PrintManager()
+    import argparse
+    parser = argparse.ArgumentParser(description="IoT printer daemon")
+    parser.add_argument('--simulate', metavar='PNG',
+                        help="run without hardware, saving the paper to PNG;"
+                             " press Enter to tap the button, 'h' to hold")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="show where startup time went on exit")
+    options = parser.parse_args()
+
+    if options.simulate:
+        import threading
+        from simulator import SimulatedPrinter, SimulatedGPIO
+        sim = SimulatedPrinter()
+        gpio = SimulatedGPIO()
+        p = PrintManager(Adafruit_Thermal(transport=sim), gpio)
+
+        def keyboard():
+            for line in iter(sys.stdin.readline, ''):
+                if line.strip().lower().startswith('h'):
+                    gpio.press(p.BUTTON_PIN, p.HOLD_TIME + 0.5)
+                else:
+                    gpio.press(p.BUTTON_PIN, 0.1)
+        thread = threading.Thread(target=keyboard)
+        thread.daemon = True
+        thread.start()
+    else:
+        p = PrintManager()
+
     p.load_config()
     p.run()
     p.cleanup()
+
+    if options.startup_report:
+        print('\n'.join(p.startup_report()))
+
+    if options.simulate:
+        sim.close()
+        sim.render().save(options.simulate)
+        print(sim.stats())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+# Per-feed metrics for the IoT printer.
+#
+# Every feed run is timed in three phases:
+#
+#   prepare   from the start of the feed to its first output (mostly
+#             fetching and parsing data)
+#   render    from its first output until the feed returns
+#   transmit  sending the recorded job to the printer
+#
+# along with the bytes sent, the printer's modeled busy time, the paper
+# used and, if it failed, the exception class.  Runs are added up per
+# feed (phase times go into histograms) and written out after each one
+# as a Prometheus textfile and/or a JSON status file, each replaced
+# atomically so readers never see half a file.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import os, time, json, threading
+
+DOTS_PER_MM = 8.0
+
+class FeedRun(object):
+    """ What happened in one run of a feed """
+
+    PHASES = ('prepare', 'render', 'transmit')
+
+    def __init__(self, feed_id):
+        self.feed = feed_id
+        self.time = time.time()
+        self.phases = {}
+        self.bytes = 0
+        self.print_time = 0.0
+        self.paper_mm = 0.0
+        self.error = None
+
+    def fail(self, e):
+        self.error = e.__class__.__name__
+
+    def measure(self, job):
+        """ Take the output figures from a recorded PrintJob """
+        self.bytes = len(job)
+        self.print_time = job.duration()
+        self.paper_mm = job.dots / DOTS_PER_MM
+
+class Histogram(object):
+    """ Cumulative bucket counts, Prometheus style """
+
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def status(self):
+        return { 'count': self.count, 'sum': self.sum,
+                 'buckets': dict(('%g' % b, n) for b, n in
+                                 zip(self.BUCKETS, self.counts)) }
+
+class FeedStats(object):
+    """ Totals for all the runs of one feed """
+
+    def __init__(self):
+        self.runs = 0
+        self.empty = 0        # runs that printed nothing (and didn't raise)
+        self.failures = {}    # exception class -> count
+        self.bytes = 0
+        self.print_time = 0.0
+        self.paper_mm = 0.0
+        self.phases = dict((p, Histogram()) for p in FeedRun.PHASES)
+        self.last = None
+        self.last_success = None
+
+    def add(self, run):
+        self.runs += 1
+        if run.error:
+            self.failures[run.error] = self.failures.get(run.error, 0) + 1
+        elif not run.bytes:
+            self.empty += 1
+        else:
+            self.last_success = run.time
+        self.bytes += run.bytes
+        self.print_time += run.print_time
+        self.paper_mm += run.paper_mm
+        for phase, seconds in run.phases.items():
+            self.phases[phase].observe(seconds)
+        self.last = run
+
+class Metrics(object):
+    """ Collects FeedRuns and exports the totals """
+
+    PREFIX = 'iotprinter_feed_'
+
+    def __init__(self, textfile=None, statusfile=None):
+        self.textfile = textfile
+        self.statusfile = statusfile
+        self.feeds = {}
+        self.lock = threading.Lock()
+
+    def record(self, run):
+        """ Add a finished run (from any thread) and export """
+        with self.lock:
+            if run.feed not in self.feeds:
+                self.feeds[run.feed] = FeedStats()
+            self.feeds[run.feed].add(run)
+            if run.error:
+                print("feed '%s' failed: %s" % (run.feed, run.error))
+            try:
+                if self.textfile:
+                    self.replace(self.textfile, self.prometheus())
+                if self.statusfile:
+                    self.replace(self.statusfile, json.dumps(self.status(),
+                                 indent=1, sort_keys=True) + '\n')
+            except (IOError, OSError) as e:
+                print("metrics export failed: %s" % (e))
+
+    @staticmethod
+    def replace(filename, data):
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'w') as f:
+            f.write(data)
+        os.rename(tmpname, filename)
+
+    @staticmethod
+    def label(value):
+        return (value.replace('\\', '\\\\').replace('"', '\\"')
+                     .replace('\n', '\\n'))
+
+    def prometheus(self):
+        """ The totals in the Prometheus text exposition format """
+        p = self.PREFIX
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append('# HELP %s%s %s' % (p, name, help))
+            lines.append('# TYPE %s%s %s' % (p, name, kind))
+            for suffix, labels, value in samples:
+                text = ','.join('%s="%s"' % (k, self.label(v))
+                                for k, v in labels)
+                lines.append('%s%s%s{%s} %r' % (p, name, suffix, text,
+                                                float(value)))
+
+        feeds = sorted(self.feeds.items())
+        metric('runs_total', 'counter', "Times the feed has run.",
+               [('', [('feed', f)], s.runs) for f, s in feeds])
+        metric('empty_runs_total', 'counter',
+               "Runs that printed nothing without raising.",
+               [('', [('feed', f)], s.empty) for f, s in feeds])
+        metric('failures_total', 'counter', "Runs that raised, by exception.",
+               [('', [('feed', f), ('error', e)], n) for f, s in feeds
+                for e, n in sorted(s.failures.items())])
+        metric('bytes_total', 'counter', "Bytes sent to the printer.",
+               [('', [('feed', f)], s.bytes) for f, s in feeds])
+        metric('print_seconds_total', 'counter',
+               "Modeled time the printer was busy.",
+               [('', [('feed', f)], s.print_time) for f, s in feeds])
+        metric('paper_mm_total', 'counter', "Estimated paper used.",
+               [('', [('feed', f)], s.paper_mm) for f, s in feeds])
+        metric('last_run_timestamp_seconds', 'gauge', "When the feed last ran.",
+               [('', [('feed', f)], s.last.time) for f, s in feeds])
+        metric('last_success_timestamp_seconds', 'gauge',
+               "When the feed last printed something.",
+               [('', [('feed', f)], s.last_success) for f, s in feeds
+                if s.last_success])
+
+        samples = []
+        for f, s in feeds:
+            for phase in FeedRun.PHASES:
+                h = s.phases[phase]
+                if not h.count:
+                    continue
+                labels = [('feed', f), ('phase', phase)]
+                for bound, n in zip(h.BUCKETS, h.counts):
+                    samples.append(('_bucket', labels + [('le', '%g' % bound)], n))
+                samples.append(('_bucket', labels + [('le', '+Inf')], h.count))
+                samples.append(('_sum', labels, h.sum))
+                samples.append(('_count', labels, h.count))
+        metric('phase_seconds', 'histogram', "Time spent in each phase.",
+               samples)
+        return '\n'.join(lines) + '\n'
+
+    def status(self):
+        """ The totals, and the last run of each feed, as a dict """
+        feeds = {}
+        for f, s in self.feeds.items():
+            last = s.last
+            feeds[f] = { 'runs': s.runs, 'empty_runs': s.empty,
+                         'failures': s.failures, 'bytes': s.bytes,
+                         'print_seconds': s.print_time,
+                         'paper_mm': s.paper_mm,
+                         'last_success': s.last_success,
+                         'phases': dict((p, h.status())
+                                        for p, h in s.phases.items()),
+                         'last': { 'time': last.time, 'phases': last.phases,
+                                   'bytes': last.bytes,
+                                   'print_seconds': last.print_time,
+                                   'paper_mm': last.paper_mm,
+                                   'error': last.error } }
+        return { 'updated': time.time(), 'feeds': feeds }
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# Recorded print jobs for the Adafruit Thermal printer.
+#
+# JobRecorder has the same API as Adafruit_Thermal, but rather than
+# talking to the serial port it compiles everything into a PrintJob:
+# the raw command stream plus a timeline of the pauses the printer
+# timing model asks for.  A job can be replayed onto a real printer
+# later (from another thread, or after a trip through a file or pipe)
+# without running the feed that produced it again.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import os, struct, json
+from Adafruit_Thermal import Adafruit_Thermal, monotonic
+
+# Printer settings that text/bitmap output depends on (and changes)
+STATE_ATTRS = [ 'prevByte', 'column', 'maxColumn', 'charHeight',
+                'lineSpacing', 'barcodeHeight', 'printMode', 'leftMargin' ]
+TIMING_ATTRS = [ 'byteTime', 'dotPrintTime', 'dotFeedTime' ]
+
+class PrintJob(object):
+    """ A compiled stream of printer commands with its pause timeline """
+
+    MAGIC   = b'PJOB'
+    VERSION = 1
+    HEADER  = struct.Struct('<4sBIII')
+    PAUSE   = struct.Struct('<Id')
+
+    def __init__(self, stream=None, pauses=None, state=None):
+        # pauses are (offset, seconds): after the bytes up to offset
+        # have been sent, the printer is busy for that long
+        self.stream = stream if stream is not None else bytearray()
+        self.pauses = pauses if pauses is not None else []
+        self.state  = state if state is not None else {}
+        self.dots   = 0   # paper the job feeds (not kept by tostring)
+        self.firstByte = None   # monotonic() time replay() started output
+
+    def __len__(self):
+        return len(self.stream)
+
+    def duration(self):
+        """ Modeled time for the printer to work through the job """
+        return sum(p[1] for p in self.pauses)
+
+    def replay(self, printer):
+        """ Send the job to a printer, honoring the recorded pauses """
+        view = memoryview(self.stream)
+        pos = 0
+        for offset, pause in self.pauses:
+            if offset > pos:
+                self.send(printer, view[pos:offset])
+                pos = offset
+            printer.timeoutSet(pause)
+        if pos < len(self.stream):
+            self.send(printer, view[pos:])
+
+        # leave the printer as the recorder left its copy
+        for attr in self.state:
+            setattr(printer, attr, self.state[attr])
+
+    def send(self, printer, data):
+        printer.timeoutWait()
+        if self.firstByte is None:
+            self.firstByte = monotonic()
+        printer.writeRaw(data)
+
+    def tostring(self):
+        """ Serialize the job to a compact binary string """
+        state = json.dumps(self.state).encode('utf-8')
+        parts = [ self.HEADER.pack(self.MAGIC, self.VERSION,
+                                   len(self.stream), len(self.pauses),
+                                   len(state)),
+                  bytes(self.stream) ]
+        for offset, pause in self.pauses:
+            parts.append(self.PAUSE.pack(offset, pause))
+        parts.append(state)
+        return b''.join(parts)
+
+    @classmethod
+    def fromstring(cls, data):
+        """ Rebuild a job serialized by tostring() """
+        magic, version, nstream, npauses, nstate = \
+            cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a print job")
+
+        pos = cls.HEADER.size
+        stream = bytearray(data[pos:pos + nstream])
+        pos += nstream
+        pauses = []
+        for i in range(npauses):
+            pauses.append(cls.PAUSE.unpack_from(data, pos))
+            pos += cls.PAUSE.size
+        state = json.loads(data[pos:pos + nstate].decode('utf-8'))
+        return cls(stream, pauses, state)
+
+    def save(self, filename):
+        """ Write the job to disk (atomically replacing any old file) """
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'wb') as f:
+            f.write(self.tostring())
+        os.rename(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls.fromstring(f.read())
+
+
+class JobRecorder(Adafruit_Thermal):
+    """ Printer stand-in that records output into a PrintJob """
+
+    def __init__(self, printer=None, state=None, baudrate=19200):
+        # Deliberately doesn't open a port or send the wake/reset
+        # sequence; the real printer has already been through that.
+        # Timing and text settings start out as the printer's (if
+        # given) so the recorded timeline matches what it would do.
+        # If the printer still has jobs queued, pass the state the
+        # last of them ends in (PrintJob.state) to start from that.
+        self.byteTime     = 11.0 / float(baudrate)
+        self.dotPrintTime = 0.03
+        self.dotFeedTime  = 0.0021
+        if printer is not None:
+            for attr in TIMING_ATTRS + STATE_ATTRS:
+                setattr(self, attr, getattr(printer, attr))
+        if state:
+            for attr in state:
+                setattr(self, attr, state[attr])
+
+        self.job = PrintJob()
+        self.pending = 0.0
+        self.firstWrite = None   # monotonic() time output started
+
+    def writeRaw(self, data):
+        if self.firstWrite is None:
+            self.firstWrite = monotonic()
+        self.job.stream += data
+
+    def timeoutSet(self, x):
+        self.pending = x
+
+    def timeoutWait(self):
+        if self.pending > 0:
+            self.job.pauses.append((len(self.job.stream), self.pending))
+        self.pending = 0.0
+
+    def hasPaper(self):
+        # nothing to ask; assume the best
+        return True
+
+    def close(self):
+        pass
+
+    def finish(self):
+        """ Close out the recording and return the PrintJob """
+        self.timeoutWait()
+        job = self.job
+        job.state = dict((attr, getattr(self, attr)) for attr in STATE_ATTRS)
+        job.dots = self.dotsFed
+
+        self.job = PrintJob()
+        self.dotsFed = 0
+        return job
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# Deadline scheduler for the IoT printer's periodic and timed feeds.
+#
+# Feeds sit in a priority queue keyed by the wall-clock time they are
+# next due, so finding the next deadline is O(1) and firing or
+# rescheduling a feed is O(log n), however many feeds are configured.
+# Cancelled or rescheduled entries are left in the heap and skipped
+# when they reach the top.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import heapq, itertools, time
+
+def next_at(when, now, allow_past=False):
+    """ Time of the next local hh:mm (given in minutes after midnight)
+
+    With allow_past, today's time is returned even if it has gone by.
+    mktime() does the date arithmetic, so month/year ends and DST
+    changes come out right.
+    """
+    t = time.localtime(now)
+    target = time.mktime((t.tm_year, t.tm_mon, t.tm_mday,
+                          when // 60, when % 60, 0, 0, 0, -1))
+    if target <= now and not allow_past:
+        target = time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1,
+                              when // 60, when % 60, 0, 0, 0, -1))
+    return target
+
+class Scheduler(object):
+    """ Priority queue of feed items by the time they are next due """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+
+    def schedule(self, item, due):
+        """ (Re)schedule an item, replacing any earlier entry for it """
+        seq = next(self.counter)
+        item['due'] = due
+        item['sched'] = seq
+        heapq.heappush(self.heap, (due, seq, item))
+
+    def cancel(self, item):
+        item['due'] = None
+        item['sched'] = None
+
+    def prune(self):
+        """ Drop stale entries from the top of the heap """
+        while self.heap and self.heap[0][2].get('sched') != self.heap[0][1]:
+            heapq.heappop(self.heap)
+
+    def next_due(self):
+        """ Earliest deadline, or None if nothing is scheduled """
+        self.prune()
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def pop_due(self, now):
+        """ Remove and return every item due at or before now """
+        due = []
+        self.prune()
+        while self.heap and self.heap[0][0] <= now:
+            item = heapq.heappop(self.heap)[2]
+            item['sched'] = None
+            due.append(item)
+            self.prune()
+        return due
+
+    def clear(self):
+        for entry in self.heap:
+            entry[2]['sched'] = None
+        self.heap = []
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+
+# Simulated hardware for the Adafruit (RPi) Internet of Things Printer.
+#
+# SimulatedPrinter is a transport for Adafruit_Thermal that stands in
+# for the serial port.  It parses the ESC/DC2/GS command stream the
+# driver emits, models how long the printer takes to work through it
+# (and whether the driver overran its input buffer), and renders the
+# resulting strip of paper to an image.  SimulatedGPIO stands in for
+# RPi.GPIO, with press() to fake button taps and holds.  Together they
+# let the whole daemon run on an ordinary Linux box.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import threading, time
+from collections import deque
+import Image, ImageDraw, ImageFont
+from Adafruit_Thermal import Adafruit_Thermal, monotonic
+
+ESC = 27
+DC2 = 18
+GS  = 29
+
+# Argument bytes taken by each command (not counting bitmap data)
+ESC_ARGS = { 55: 3, 64: 0, 33: 1, 97: 1, 74: 1, 45: 1, 61: 1, 56: 1,
+             118: 1, 51: 1, 32: 1, 100: 1, 69: 1, 123: 1 }
+DC2_ARGS = { 42: 2, 35: 1, 84: 0 }
+GS_ARGS  = { 33: 1, 72: 1, 119: 1, 104: 1, 76: 2, 107: 1, 97: 1 }
+
+class SimulatedPrinter(object):
+    """ Adafruit_Thermal transport that models and renders a printer """
+
+    WIDTH       = 384     # dots across the paper
+    BUFFER_SIZE = 4096    # bytes of input the printer can hold
+    DOTS_PER_MM = 8
+    MAX_COMMAND = 4 + 255 * 255  # largest command (a full bitmap chunk)
+
+    def __init__(self, baudrate=19200, dot_print_time=0.03,
+                 dot_feed_time=0.0021, realtime=True, keep_paper=True):
+        self.byte_time = 11.0 / float(baudrate)
+        self.dot_print_time = dot_print_time
+        self.dot_feed_time = dot_feed_time
+        # with realtime False the clock only moves as the model says,
+        # so nothing waits on it (the driver pacing still sleeps)
+        self.realtime = realtime
+        # with keep_paper False nothing is rasterized, only measured
+        self.keep_paper = keep_paper
+
+        self.lock = threading.Lock()
+        self.pending = bytearray()
+        self.replies = bytearray()
+        self.rows = []           # rendered paper, one bytearray per dot row
+        self.dots = 0            # length of paper used, in dot rows
+        self.text = []           # characters of the line being built
+        self.wrapped = False     # last character filled up a line
+        self.inflight = deque()  # (finish time, bytes) still in the buffer
+        self.busy_until = 0.0
+        self.reset()
+
+        # statistics
+        self.bytes = 0
+        self.commands = 0
+        self.print_time = 0.0
+        self.overruns = 0
+        self.max_buffered = 0
+
+    def reset(self):
+        self.mode = 0
+        self.size = 0
+        self.justify = 0
+        self.underline = 0
+        self.line_height = 32
+        self.left_margin = 0
+
+    # --- transport interface ---
+
+    def write(self, data):
+        data = bytearray(data)
+        with self.lock:
+            self.bytes += len(data)
+            self.pending += data
+            self.parse()
+        return len(data)
+
+    def read(self, size=1):
+        with self.lock:
+            data = bytes(self.replies[:size])
+            del self.replies[:size]
+        return data
+
+    def close(self):
+        with self.lock:
+            self.flush_text()
+
+    def flush(self):
+        pass
+
+    # --- timing model ---
+
+    def now(self):
+        if self.realtime:
+            return monotonic()
+        return self.busy_until
+
+    def busy(self, nbytes, seconds):
+        """ Account for one command taking 'seconds' once it is reached """
+        arrival = self.now() + nbytes * self.byte_time
+        start = max(arrival, self.busy_until)
+        self.busy_until = start + seconds
+        self.print_time += nbytes * self.byte_time + seconds
+        self.commands += 1
+
+        # anything finished by now has left the input buffer
+        while self.inflight and self.inflight[0][0] <= arrival:
+            self.inflight.popleft()
+        self.inflight.append((self.busy_until, nbytes))
+        buffered = sum(n for t, n in self.inflight)
+        if buffered > self.max_buffered:
+            self.max_buffered = buffered
+        if buffered > self.BUFFER_SIZE:
+            self.overruns += 1
+
+    # --- command parser ---
+
+    def parse(self):
+        pos = 0
+        while pos < len(self.pending):
+            used = self.command(self.pending, pos)
+            if not used:
+                break   # incomplete, wait for more data
+            pos += used
+        del self.pending[:pos]
+
+    def command(self, buf, pos):
+        """ Handle the command at buf[pos]; return bytes used """
+        c = buf[pos]
+        if c in (ESC, DC2, GS):
+            buf = buf[pos:pos + self.MAX_COMMAND]
+            if len(buf) < 2:
+                return 0
+            table = { ESC: ESC_ARGS, DC2: DC2_ARGS, GS: GS_ARGS }[c]
+            nargs = table.get(buf[1], 0)
+            if len(buf) < 2 + nargs:
+                return 0
+            args = buf[2:2 + nargs]
+            if c == ESC:
+                return self.esc(buf[1], args)
+            elif c == DC2:
+                return self.dc2(buf, args)
+            else:
+                return self.gs(buf, args)
+
+        wrapped, self.wrapped = self.wrapped, False
+        if c == 10:
+            # a newline right after a full line doesn't add a blank one
+            if not wrapped:
+                self.finish_line()
+            self.busy(1, 0)
+        elif c == 12 or c == 255 or c == 9 or c < 32:
+            self.busy(1, 0)
+        else:
+            self.text.append(chr(c))
+            self.busy(1, 0)
+            if len(self.text) >= self.columns():
+                self.finish_line()
+                self.wrapped = True
+        return 1
+
+    def esc(self, cmd, args):
+        if cmd == 64:
+            self.reset()
+        elif cmd == 33:
+            self.mode = args[0]
+        elif cmd == 97:
+            self.justify = args[0]
+        elif cmd == 45:
+            self.underline = args[0]
+        elif cmd == 51:
+            self.line_height = args[0]
+        elif cmd == 74:
+            self.flush_text()
+            self.feed(args[0])
+            self.busy(3, args[0] * self.dot_feed_time)
+            return 3
+        elif cmd == 118:
+            self.replies.append(0)   # paper present
+        self.busy(2 + len(args), 0)
+        return 2 + len(args)
+
+    def dc2(self, buf, args):
+        if buf[1] == 42:
+            rows, width = args[0], args[1]
+            need = 4 + rows * width
+            if len(buf) < need:
+                return 0
+            self.flush_text()
+            data = buf[4:need]
+            for r in range(rows):
+                self.blit(data[r * width:(r + 1) * width])
+            self.busy(need, rows * self.dot_print_time)
+            return need
+        elif buf[1] == 84:
+            self.busy(2, self.dot_print_time * 24 * 26 +
+                         self.dot_feed_time * (8 * 26 + 32))
+            return 2
+        self.busy(2 + len(args), 0)
+        return 2 + len(args)
+
+    def gs(self, buf, args):
+        cmd = buf[1]
+        if cmd == 33:
+            self.size = args[0]
+        elif cmd == 76:
+            self.left_margin = args[0] | (args[1] << 8)
+        elif cmd == 107:
+            # barcode data runs up to a NUL or newline
+            end = 3
+            while end < len(buf) and buf[end] not in (0, 10):
+                end += 1
+            if end >= len(buf):
+                return 0
+            self.flush_text()
+            self.feed(50 + 40)
+            self.busy(end + 1, 90 * self.dot_print_time)
+            return end + 1
+        self.busy(2 + len(args), 0)
+        return 2 + len(args)
+
+    # --- paper rendering ---
+
+    def columns(self):
+        if self.mode & Adafruit_Thermal.DOUBLE_WIDTH_MASK or self.size & 0x10:
+            return 16
+        return 32
+
+    def char_height(self):
+        if self.mode & Adafruit_Thermal.DOUBLE_HEIGHT_MASK or self.size & 0x01:
+            return 48
+        return 24
+
+    def blit(self, data):
+        """ Add one bitmap row to the paper """
+        row = bytearray(self.WIDTH // 8)
+        offset = self.left_margin // 8
+        data = data[:len(row) - offset]
+        row[offset:offset + len(data)] = data
+        self.add_row(row)
+
+    def add_row(self, row):
+        self.dots += 1
+        if self.keep_paper:
+            self.rows.append(row)
+
+    def feed(self, dots):
+        self.dots += dots
+        if self.keep_paper:
+            for i in range(dots):
+                self.rows.append(bytearray(self.WIDTH // 8))
+
+    def flush_text(self):
+        """ Print any partial line of text still waiting for a newline """
+        if self.text:
+            self.finish_line()
+
+    def finish_line(self):
+        """ Print the pending line of text (or feed a blank one) """
+        height = self.char_height()
+        pitch = max(self.line_height, height)
+        if not self.text:
+            self.feed(pitch)
+            self.busy(0, pitch * self.dot_feed_time)
+            return
+
+        cols = self.columns()
+        text = ''.join(self.text)
+        self.text = []
+        self.busy(0, height * self.dot_print_time +
+                     (pitch - height) * self.dot_feed_time)
+        if not self.keep_paper:
+            self.dots += pitch
+            return
+
+        if self.justify == 1:
+            text = text.center(cols)
+        elif self.justify == 2:
+            text = text.rjust(cols)
+
+        # draw with PIL's built-in 6x11 font, then stretch to size
+        small = Image.new('1', (cols * 6, 12), 'white')
+        draw = ImageDraw.Draw(small)
+        font = ImageFont.load_default()
+        if self.mode & Adafruit_Thermal.INVERSE_MASK:
+            draw.rectangle([0, 0, len(text.rstrip()) * 6, 12], fill='black')
+            ink = 'white'
+        else:
+            ink = 'black'
+        draw.text((0, 0), text, font=font, fill=ink)
+        if self.mode & Adafruit_Thermal.BOLD_MASK:
+            draw.text((1, 0), text, font=font, fill=ink)
+        if self.underline:
+            draw.rectangle([0, 11 - self.underline + 1,
+                            len(text.rstrip()) * 6, 11], fill=ink)
+        line = small.resize((self.WIDTH, height))
+        if self.mode & Adafruit_Thermal.UPDOWN_MASK:
+            line = line.rotate(180)
+
+        width, rows, bitmap = Adafruit_Thermal.packImage(line)
+        row_bytes = (width + 7) // 8
+        for r in range(rows):
+            self.add_row(bitmap[r * row_bytes:(r + 1) * row_bytes])
+        self.feed(pitch - height)
+
+    def paper_length(self):
+        """ Length of paper used so far, in millimeters """
+        return self.dots / float(self.DOTS_PER_MM)
+
+    def render(self):
+        """ Return the paper printed so far as a PIL image """
+        with self.lock:
+            rows = list(self.rows)
+        img = Image.new('1', (self.WIDTH, max(len(rows), 1)), 'white')
+        if rows:
+            data = bytes(b''.join(bytes(r) for r in rows))
+            data = data.translate(Adafruit_Thermal.invertTable)
+            frombytes = getattr(Image, 'frombytes', None) or Image.fromstring
+            img = frombytes('1', (self.WIDTH, len(rows)), data)
+        return img
+
+    def stats(self):
+        return { 'bytes': self.bytes,
+                 'commands': self.commands,
+                 'print_time': self.print_time,
+                 'paper_mm': self.paper_length(),
+                 'overruns': self.overruns,
+                 'max_buffered': self.max_buffered }
+
+
+class SimulatedGPIO(object):
+    """ Stand-in for the parts of RPi.GPIO that the print manager uses """
+
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    HIGH = 1
+    LOW = 0
+    PUD_UP = 22
+    PUD_DOWN = 21
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+        self.lock = threading.Lock()
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self.levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def output(self, pin, level):
+        self.levels[pin] = level
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self.callbacks = {}
+
+    def set_input(self, pin, level):
+        """ Drive an input pin, firing any edge callback like RPi.GPIO """
+        with self.lock:
+            if self.levels.get(pin) == level:
+                return
+            self.levels[pin] = level
+            edge, callback = self.callbacks.get(pin, (None, None))
+        if callback and (edge == self.BOTH or
+                         (edge == self.RISING and level == self.HIGH) or
+                         (edge == self.FALLING and level == self.LOW)):
+            callback(pin)
+
+    def press(self, pin, seconds=0.1):
+        """ Press (pull low) a button for a while, in the background """
+        def worker():
+            self.set_input(pin, self.LOW)
+            time.sleep(seconds)
+            self.set_input(pin, self.HIGH)
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        return thread
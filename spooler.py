@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Print spooler for the Adafruit Thermal printer.
+#
+# A single thread owns the printer and works through a bounded queue of
+# print jobs, so feeds can go on fetching and rendering the next job
+# while earlier ones are still being pushed out to the (slow) printer.
+# Jobs print strictly in the order they were submitted.  When the queue
+# is full, submit() blocks, which keeps memory use bounded; offer() is
+# for callers (like the event loop) that must not block.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import threading, Queue
+from Adafruit_Thermal import monotonic
+
+class Spooler(object):
+    """ Printer-owner thread with a bounded job queue """
+
+    def __init__(self, printer, maxjobs=4, on_busy=None, on_idle=None,
+                 on_start=None, on_done=None):
+        self.printer = printer
+        self.queue = Queue.Queue(maxjobs)
+        self.on_busy = on_busy
+        self.on_idle = on_idle
+        self.on_start = on_start   # called with each job as it starts
+        self.on_done = on_done     # ... and (job, seconds, error) after
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.worker, name='spooler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, job):
+        """ Queue a PrintJob, or a callable taking the printer """
+        self.queue.put(job)
+
+    def offer(self, job):
+        """ Queue a job if there's room; returns whether it was queued """
+        try:
+            self.queue.put_nowait(job)
+        except Queue.Full:
+            return False
+        return True
+
+    def idle(self):
+        """ Whether everything submitted so far has printed """
+        return self.queue.unfinished_tasks == 0
+
+    def drain(self):
+        """ Wait until everything submitted so far has printed """
+        self.queue.join()
+
+    def stop(self):
+        """ Finish the queued jobs and shut the thread down """
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def worker(self):
+        busy = False
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                break
+
+            if not busy and self.on_busy:
+                self.on_busy()
+            busy = True
+            if self.on_start:
+                self.on_start(job)
+
+            start = monotonic()
+            error = None
+            try:
+                if callable(job):
+                    job(self.printer)
+                else:
+                    job.replay(self.printer)
+            except Exception as e:
+                error = e
+            if self.on_done:
+                try:
+                    self.on_done(job, monotonic() - start, error)
+                except Exception as e:
+                    print("spooler: job callback failed: %r" % (e))
+            self.queue.task_done()
+
+            if self.queue.empty():
+                busy = False
+                if self.on_idle:
+                    self.on_idle()
+
+        if busy and self.on_idle:
+            self.on_idle()
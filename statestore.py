@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Persistent feed state for the IoT printer.
+#
+# Each feed's state dict (twitter's lastId and so on) is kept in one
+# JSON file, keyed by its config section, so progress survives restarts
+# and power cuts.  The file is only read when a feed first asks for its
+# state.  Saving a feed's state rewrites the file only if it actually
+# changed, by writing a temporary file, fsync()ing it and renaming it
+# over the old one, so the file on disk is always either the old or the
+# new version, never a torn one.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+import os, json, threading
+
+class StateStore(object):
+    """ Feed state dicts by section id, saved atomically to a file """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.states = None   # section id -> encoded state, once loaded
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    @staticmethod
+    def encode(state):
+        """ Snapshot a state dict, or None if it can't be saved """
+        try:
+            return json.dumps(state, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+
+    def load(self):
+        if self.states is not None:
+            return
+        self.states = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                for key, state in data['feeds'].items():
+                    self.states[key] = self.encode(state)
+        except IOError:
+            pass   # nothing saved yet
+        except (ValueError, KeyError, AttributeError):
+            # can only happen if something else wrote the file; keep it
+            # for a look and start again
+            print("state file '%s' unreadable, starting afresh" % (self.path))
+            try:
+                os.rename(self.path, self.path + '.bad')
+            except OSError:
+                pass
+
+    def get(self, key):
+        """ A (new) copy of the saved state for a section """
+        with self.lock:
+            self.load()
+            encoded = self.states.get(key)
+        if encoded is None:
+            return {}
+        return json.loads(encoded)
+
+    def put(self, key, encoded):
+        """ Save a section's state (as given by encode()) if it changed """
+        if encoded is None:
+            return
+        with self.lock:
+            self.load()
+            if self.states.get(key) == encoded:
+                return
+            self.states[key] = encoded
+            self.write()
+
+    def write(self):
+        feeds = ', '.join('%s: %s' % (json.dumps(k), self.states[k])
+                          for k in sorted(self.states))
+        data = '{"version": %d, "feeds": {%s}}\n' % (self.VERSION, feeds)
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+
+        # make the rename itself stick
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)),
+                         os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+        self.writes += 1
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# One-pass XML field extraction for the IoT printer's feeds.
+#
+# Rather than building a DOM and searching it over and over, the
+# document goes once through expat, keeping only the elements asked for
+# (their attributes and text) and stopping as soon as it has them all.
+# Tag names are matched as written in the document, prefixes included
+# ('yweather:forecast'), the same as minidom's getElementsByTagName.
+#
+# Written by Ted M Lin.  MIT license.
+
+from __future__ import print_function
+from xml.parsers import expat
+
+class Element(object):
+    """ An element's attributes and (direct) text """
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self.text = u''
+
+    def get(self, name, default=u''):
+        return self.attrs.get(name, default)
+
+class Done(Exception):
+    pass
+
+class Extractor(object):
+    """ Expat handlers collecting elements by tag name """
+
+    def __init__(self, counts, record=None):
+        # counts: tag -> how many to keep (None for all); within a
+        # record element, counts are per record
+        self.counts = counts
+        self.record = record
+        self.found = dict((tag, []) for tag in counts)
+        self.records = []
+        self.open = []   # Elements being collected, innermost last
+        self.stack = []  # whether each open tag is being collected
+
+    def parse(self, data):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.text
+        try:
+            parser.Parse(data, True)
+        except Done:
+            pass
+        return self
+
+    def start(self, tag, attrs):
+        if tag == self.record:
+            self.found = dict((t, []) for t in self.counts)
+            self.records.append(self.found)
+        collect = False
+        if tag in self.found and not self.full(tag):
+            element = Element(attrs)
+            self.found[tag].append(element)
+            self.open.append(element)
+            collect = True
+        self.stack.append(collect)
+
+    def end(self, tag):
+        if self.stack.pop():
+            self.open.pop()
+            if not self.record and all(self.full(t) for t in self.counts):
+                raise Done()
+
+    def text(self, data):
+        if self.stack and self.stack[-1]:
+            self.open[-1].text += data
+
+    def full(self, tag):
+        count = self.counts[tag]
+        return count is not None and len(self.found[tag]) >= count
+
+def first(data, counts):
+    """ The first few elements with each tag name
+
+    counts maps tag name to how many are wanted; returns a dict of tag
+    name to the list of Elements found (which may be short).
+    """
+    return Extractor(counts).parse(data).found
+
+def records(data, record, fields):
+    """ For each 'record' element, the first element of each field tag
+
+    Returns a list with a dict per record, of field tag name to its
+    Element (missing fields are left out).
+    """
+    counts = dict((tag, 1) for tag in fields)
+    result = []
+    for found in Extractor(counts, record).parse(data).records:
+        result.append(dict((tag, found[tag][0]) for tag in found
+                           if found[tag]))
+    return result